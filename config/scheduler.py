@@ -1,6 +1,18 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from config.settings import settings
+from services.service_leader import Leader
 
 
 scheduler = AsyncIOScheduler(timezone=settings.TIMEZONE_LOCAL)
+
+
+# jobs decorated with Leader.only run in one process only
+@scheduler.scheduled_job(
+    "interval",
+    id="leader_heartbeat",
+    seconds=settings.LEADER_HEARTBEAT,
+    coalesce=True,
+)
+async def leader_heartbeat() -> bool:
+    return await Leader.heartbeat()
@@ -5,12 +5,97 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     SQLALCHEMY_DATABASE_URI: str = getenv("SQLALCHEMY_DB_URI")
+    # read replica for heavy GET endpoints, primary is used when not set
+    SQLALCHEMY_DATABASE_URI_READONLY: str | None = getenv("SQLALCHEMY_DB_URI_READONLY")
+    # seconds replica is expected to lag behind primary
+    DB_READONLY_LAG: float = getenv("DB_READONLY_LAG", 2)
+    # connection pool of each engine
+    DB_POOL_SIZE: int = getenv("DB_POOL_SIZE", 10)
+    DB_MAX_OVERFLOW: int = getenv("DB_MAX_OVERFLOW", 20)
+    DB_POOL_PRE_PING: bool = getenv("DB_POOL_PRE_PING", True)
+    DB_POOL_RECYCLE: int = getenv("DB_POOL_RECYCLE", 1800)
+    DB_POOL_TIMEOUT: float = getenv("DB_POOL_TIMEOUT", 30)
+    # statements cached per connection
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = getenv(
+        "DB_PREPARED_STATEMENT_CACHE_SIZE", 100
+    )
+    # pgbouncer in transaction mode: no statement caches & unique statement
+    # names, connections are shared so names of asyncpg would collide
+    DB_PGBOUNCER: bool = getenv("DB_PGBOUNCER", False)
+    # statements counted & timed per request, see QueryStats
+    SQL_INSTRUMENTATION: bool = getenv("SQL_INSTRUMENTATION", True)
+    SQL_SLOW_QUERY_MS: float = getenv("SQL_SLOW_QUERY_MS", 200)
+    # same statement executed this many times in one request is logged
+    SQL_REPEATED_STATEMENTS: int = getenv("SQL_REPEATED_STATEMENTS", 10)
     TIMEZONE_LOCAL: str = getenv("TIMEZONE_LOCAL")
     SWAMP_PARSER: str = getenv("SWAMP_PARSER")
+    SWAMP_PARSER_LIMIT: int = getenv("SWAMP_PARSER_LIMIT", 100)
+    SWAMP_PARSER_LIMIT_PER_HOST: int = getenv("SWAMP_PARSER_LIMIT_PER_HOST", 0)
+    SWAMP_PARSER_DNS_TTL: int = getenv("SWAMP_PARSER_DNS_TTL", 300)
+    SWAMP_PARSER_KEEPALIVE: float = getenv("SWAMP_PARSER_KEEPALIVE", 60)
+    SWAMP_PARSER_TIMEOUT: float = getenv("SWAMP_PARSER_TIMEOUT", 120)
+    SWAMP_PARSER_TIMEOUT_CONNECT: float = getenv("SWAMP_PARSER_TIMEOUT_CONNECT", 10)
+    # Feed refresh settings
+    REFRESH_ENABLED: bool = getenv("REFRESH_ENABLED", False)
+    REFRESH_INTERVAL_MINUTES: int = getenv("REFRESH_INTERVAL_MINUTES", 5)
+    REFRESH_CONCURRENCY: int = getenv("REFRESH_CONCURRENCY", 16)
+    REFRESH_CONCURRENCY_PER_HOST: int = getenv("REFRESH_CONCURRENCY_PER_HOST", 2)
+    # feeds ingested at once, capped by DB_POOL_SIZE so requests still get one
+    REFRESH_CONCURRENCY_DB: int = getenv("REFRESH_CONCURRENCY_DB", 4)
+    # due feeds claimed by one run, they are not given to others for lease time
+    REFRESH_CLAIM_LIMIT: int = getenv("REFRESH_CLAIM_LIMIT", 1000)
+    REFRESH_LEASE_MINUTES: int = getenv("REFRESH_LEASE_MINUTES", 30)
+    # feeds committed per transaction by bulk ingest
+    INGEST_BATCH_FEEDS: int = getenv("INGEST_BATCH_FEEDS", 50)
+    # rows of bulk ingest request body normalized & ingested at once
+    INGEST_BATCH_ROWS: int = getenv("INGEST_BATCH_ROWS", 5000)
+    # seconds X-Cursor-Since of /updates/ is held back, so rows committed
+    # (or replicated) later than their dt_event are still fetched next time
+    UPDATES_SINCE_LAG: float = getenv("UPDATES_SINCE_LAG", 120)
+    # next poll from publishing rate of the feed, see Feed.schedule
+    ADAPTIVE_POLLING: bool = getenv("ADAPTIVE_POLLING", False)
+    ADAPTIVE_POLLING_HISTORY: int = getenv("ADAPTIVE_POLLING_HISTORY", 20)
+    # share of median interval between updates to wait before next poll
+    ADAPTIVE_POLLING_FACTOR: float = getenv("ADAPTIVE_POLLING_FACTOR", 0.5)
+    # next polls are spread so at most SLOT_BUDGET feeds are due per slot,
+    # moved by up to SLOT_MAX_SHIFT minutes within bounds of their frequency
+    SLOTS_ENABLED: bool = getenv("SLOTS_ENABLED", False)
+    SLOT_MINUTES: int = getenv("SLOT_MINUTES", 5)
+    SLOT_BUDGET: int = getenv("SLOT_BUDGET", 50)
+    SLOT_MAX_SHIFT: int = getenv("SLOT_MAX_SHIFT", 120)
+    # pg_trgm similarity of href path (without host) or title for feeds
+    # to be reported as similar, only the same href is a duplicate
+    FEED_SIMILARITY_THRESHOLD: float = getenv("FEED_SIMILARITY_THRESHOLD", 0.5)
+    FEED_SIMILARITY_LIMIT: int = getenv("FEED_SIMILARITY_LIMIT", 10)
+    # bulk feed import: hrefs checked against DB at once, parsed in parallel
+    IMPORT_BATCH: int = getenv("IMPORT_BATCH", 200)
+    IMPORT_CONCURRENCY: int = getenv("IMPORT_CONCURRENCY", 8)
+    # seconds between parser requests to the same host
+    IMPORT_HOST_INTERVAL: float = getenv("IMPORT_HOST_INTERVAL", 5)
+    # batches of updates this big are normalized in worker processes, 0 disables
+    NORMALIZE_PROCESS_THRESHOLD: int = getenv("NORMALIZE_PROCESS_THRESHOLD", 5000)
+    NORMALIZE_PROCESS_CHUNK: int = getenv("NORMALIZE_PROCESS_CHUNK", 1000)
+    NORMALIZE_PROCESS_WORKERS: int | None = getenv("NORMALIZE_PROCESS_WORKERS")
+    # Redis settings
+    REDIS_MAX_CONNECTIONS: int = getenv("REDIS_MAX_CONNECTIONS", 50)
+    # one instance runs scheduled jobs, others take over within LEADER_TTL seconds
+    LEADER_ELECTION: bool = getenv("LEADER_ELECTION", True)
+    LEADER_TTL: float = getenv("LEADER_TTL", 15)
+    LEADER_HEARTBEAT: float = getenv("LEADER_HEARTBEAT", 5)
+    # cached GET responses of /feeds/ & /updates/, reset on every write
+    RESPONSE_CACHE_ENABLED: bool = getenv("RESPONSE_CACHE_ENABLED", True)
+    RESPONSE_CACHE_TTL: int = getenv("RESPONSE_CACHE_TTL", 60)
     # Telegram settings
     TELEGRAM_CHATID: int = getenv("TELEGRAM_CHATID")
     TELEGRAM_BROADCAST: bool = getenv("TELEGRAM_BROADCAST", False)
     TELEGRAM_BOTTOKEN: str = getenv("TELEGRAM_BOTTOKEN")
+    # seconds between messages, telegram allows ~1 per second in a chat
+    TELEGRAM_MESSAGE_INTERVAL: float = getenv("TELEGRAM_MESSAGE_INTERVAL", 1)
+    # notification outbox, all values in seconds except attempts
+    TELEGRAM_OUTBOX_INTERVAL: int = getenv("TELEGRAM_OUTBOX_INTERVAL", 10)
+    TELEGRAM_OUTBOX_BACKOFF: int = getenv("TELEGRAM_OUTBOX_BACKOFF", 30)
+    TELEGRAM_OUTBOX_BACKOFF_MAX: int = getenv("TELEGRAM_OUTBOX_BACKOFF_MAX", 3600)
+    TELEGRAM_OUTBOX_ATTEMPTS: int = getenv("TELEGRAM_OUTBOX_ATTEMPTS", 10)
 
 
 # import this one:
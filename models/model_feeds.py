@@ -1,17 +1,30 @@
 import logging
-from datetime import datetime
+import random
+import re
+import statistics
+from datetime import datetime, timedelta, timezone
+from itertools import pairwise
 from typing import List
 from typing import TYPE_CHECKING
 
-import aiohttp
 from sqlalchemy import (
+    case,
+    cast,
+    column,
+    exists,
     func,
+    Index,
     Integer,
     JSON,
+    literal,
     or_,
     select,
     String,
+    text,
+    update,
+    values,
 )
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import (
     mapped_column,
@@ -21,9 +34,14 @@ from sqlalchemy.orm import (
 
 from config.settings import settings
 from models.model_base import Base
+from models.model_notifications import Notification
+from services.service_filter import FeedFilter
 from services.service_frequency import Frequency
+from services.service_metrics import Metrics
+from services.service_parser import SwampParser
+from services.service_response_cache import ResponseCache
+from services.service_slots import Slots
 from services.service_sqlalchemy import SQLAlchemy
-from services.service_telegram import TelegramService
 
 
 if TYPE_CHECKING:
@@ -34,7 +52,24 @@ logger = logging.getLogger(__name__)
 
 
 class Feed(Base):
+    # CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    # CREATE INDEX feed_href_normalized_index ON feed_updates.feed (rtrim(split_part(regexp_replace(lower(href), '^https?://(www\.)?', ''), '#', 1), '/'));
+    # DROP INDEX IF EXISTS feed_updates.feed_href_normalized_trgm_index;
+    # CREATE INDEX feed_href_path_trgm_index ON feed_updates.feed USING gin (regexp_replace(rtrim(split_part(regexp_replace(lower(href), '^https?://(www\.)?', ''), '#', 1), '/'), '^[^/]*/?', '') gin_trgm_ops);
+    # CREATE INDEX feed_title_lower_index ON feed_updates.feed (lower(title));
+    # CREATE INDEX feed_title_trgm_index ON feed_updates.feed USING gin (lower(title) gin_trgm_ops);
+    # CREATE INDEX feed_delayed_active_index ON feed_updates.feed (_delayed) WHERE frequency != 'NEVER';
+
     __tablename__ = "feed"
+    __table_args__ = (
+        # due feeds, see query_requires_update & claim
+        Index(
+            "feed_delayed_active_index",
+            "_delayed",
+            postgresql_where=text("frequency != 'NEVER'"),
+        ),
+        Base.__table_args__,
+    )
 
     # TECHNICAL
     _id: Mapped[int] = mapped_column(
@@ -119,6 +154,20 @@ class Feed(Base):
         elif _id or _created or _delayed:
             raise Exception("Pass all or none of [_id, _created, _delayed]")
 
+    # keys of as_dict(), used to validate requested subsets of them
+    DICT_FIELDS = (
+        "_id",
+        "_created",
+        "_delayed",
+        "title",
+        "href",
+        "href_user",
+        "private",
+        "frequency",
+        "notes",
+        "json",
+    )
+
     def as_dict(self) -> dict:
         return {
             "_id": self._id,
@@ -136,22 +185,133 @@ class Feed(Base):
     def __repr__(self):
         return str(self.as_dict())
 
-    async def get_similar_feeds(self, session: AsyncSession):
-        query = select(Feed)
-        query = query.where(
-            Feed._id != getattr(self, "id", None),
+    @staticmethod
+    def normalize_href(href: str) -> str:
+        # keep in sync with normalize_href_sql
+        href = re.sub(r"^https?://(www\.)?", "", href.lower())
+        href = href.split("#")[0]
+
+        return href.rstrip("/")
+
+    @staticmethod
+    def normalize_href_sql(href):
+        # literals are inlined, otherwise expression indexes are not used
+        href = func.regexp_replace(
+            func.lower(href),
+            literal(r"^https?://(www\.)?", literal_execute=True),
+            literal("", literal_execute=True),
+        )
+        href = func.split_part(
+            href,
+            literal("#", literal_execute=True),
+            literal(1, literal_execute=True),
+        )
+
+        return func.rtrim(href, literal("/", literal_execute=True))
+
+    @staticmethod
+    def href_path(href: str) -> str:
+        # normalized href without host: handles of the same website
+        # would be similar because of shared host trigrams otherwise;
+        # keep in sync with href_path_sql
+        return re.sub(r"^[^/]*/?", "", href)
+
+    @staticmethod
+    def href_path_sql(href):
+        return func.regexp_replace(
+            href,
+            literal(r"^[^/]*/?", literal_execute=True),
+            literal("", literal_execute=True),
+        )
+
+    def is_duplicate(self, other: "Feed") -> bool:
+        # only exact normalized href is a duplicate, similarity is a hint
+        return self.normalize_href(self.href) == self.normalize_href(other.href)
+
+    @classmethod
+    async def find_similar(
+        cls,
+        feeds: list["Feed"],
+        session: AsyncSession,
+    ) -> list[list[tuple["Feed", float]]]:
+        # one query for all feeds, results are in the same order as feeds,
+        # each one has up to FEED_SIMILARITY_LIMIT (feed, similarity) pairs;
+        # exact normalized href scores 1, see is_duplicate
+        if not feeds:
+            return []
+
+        candidate = values(
+            column("index", Integer),
+            column("_id", Integer),
+            column("title", String),
+            column("title_short", String),
+            column("href", String),
+            column("path", String),
+            name="candidate",
+        ).data(
+            [
+                (
+                    index,
+                    getattr(feed, "_id", None),
+                    feed.title.lower(),
+                    # " - " is usually used to separate title from website name
+                    feed.title.split(" - ")[0].lower(),
+                    cls.normalize_href(feed.href),
+                    # website without path has nothing to compare
+                    cls.href_path(cls.normalize_href(feed.href)) or None,
+                )
+                for index, feed in enumerate(feeds)
+            ]
+        )
+        href = cls.normalize_href_sql(cls.href)
+        path = cls.href_path_sql(href)
+        title = func.lower(cls.title)
+        similarity = func.greatest(
+            case((href == candidate.c.href, 1.0), else_=0.0),
+            func.similarity(path, candidate.c.path),
+            func.similarity(title, candidate.c.title),
+            func.similarity(title, candidate.c.title_short),
+        )
+
+        query = select(candidate.c.index, cls, similarity)
+        query = query.join(
+            cls,
             or_(
-                Feed.title == self.title,
-                # " - " is usually used to separate title from website name
-                Feed.title == self.title.split(" - ")[0],
-                Feed.href == self.href,
+                href == candidate.c.href,
+                title == candidate.c.title,
+                title == candidate.c.title_short,
+                path.op("%")(candidate.c.path),
+                title.op("%")(candidate.c.title),
+                title.op("%")(candidate.c.title_short),
             ),
         )
-
-        return await SQLAlchemy.execute_all(
-            query=query,
-            session=session,
+        query = query.where(
+            # new feeds have no _id, their NULLs need a type
+            cls._id.is_distinct_from(cast(candidate.c._id, Integer)),
         )
+        query = query.order_by(candidate.c.index, similarity.desc(), cls._id)
+
+        # threshold of % operator, for current transaction only
+        await session.execute(
+            select(
+                func.set_config(
+                    "pg_trgm.similarity_threshold",
+                    str(settings.FEED_SIMILARITY_THRESHOLD),
+                    True,
+                )
+            )
+        )
+        rows = await session.execute(query)
+
+        results = [[] for _ in feeds]
+        for index, feed, score in rows:
+            if len(results[index]) < settings.FEED_SIMILARITY_LIMIT:
+                results[index].append((feed, round(score, 3)))
+
+        return results
+
+    async def get_similar_feeds(self, session: AsyncSession):
+        return (await Feed.find_similar([self], session=session))[0]
 
     def update_attr(self, key: str, value):
         if not hasattr(self, key):
@@ -176,57 +336,103 @@ class Feed(Base):
             self.frequency = Frequency(value)
             self.delay()
 
+    @classmethod
+    def is_active(cls):
+        # inlined, so planner can prove partial feed_delayed_active_index
+        # applies; with bound parameter generic plans do not use it
+        return cls.frequency != literal(
+            Frequency.NEVER,
+            type_=cls.frequency.type,
+            literal_execute=True,
+        )
+
     @classmethod
     def query_requires_update(cls, query):
         return query.where(
-            cls.frequency != Frequency.NEVER,
+            cls.is_active(),
             cls._delayed <= datetime.now(),
         )
 
+    @classmethod
+    async def claim(
+        cls,
+        limit: int,
+        lease: timedelta,
+        session: AsyncSession,
+    ) -> list:
+        # due feeds are leased by moving _delayed forward, so other workers
+        # skip them; ingest sets real _delayed, if worker dies lease expires
+        query = cls.query_requires_update(select(cls._id))
+        query = query.order_by(cls._delayed)
+        query = query.limit(limit)
+        query = query.with_for_update(skip_locked=True)
+
+        query = (
+            update(cls)
+            .where(cls._id.in_(query.scalar_subquery()))
+            .values(_delayed=datetime.now() + lease)
+            .returning(cls._id, cls.href)
+        )
+
+        return (await session.execute(query)).all()
+
     def delay(self):
         self._delayed = datetime.now() + self.frequency.delay()
 
+    async def adaptive_delay(self, session: AsyncSession) -> timedelta | None:
+        # based on how often feed publishes, within bounds of its frequency
+        # circular import: Update model imports Feed
+        from models.model_updates import Update
+
+        query = select(Update.dt_original)
+        query = query.where(Update.feed_id == self._id)
+        query = query.order_by(Update.dt_original.desc())
+        query = query.limit(settings.ADAPTIVE_POLLING_HISTORY)
+        history = (await session.scalars(query)).all()
+        if len(history) < 3:
+            # not enough updates to guess anything
+            return None
+
+        gaps = [(newer - older).total_seconds() for newer, older in pairwise(history)]
+        interval = statistics.median(gaps) * settings.ADAPTIVE_POLLING_FACTOR
+        # feeds silent for longer than usual are polled less often
+        silence = (datetime.now(timezone.utc) - history[0]).total_seconds()
+        interval = max(interval, silence * settings.ADAPTIVE_POLLING_FACTOR)
+        # jitter, so feeds with same history are not polled at once
+        interval *= random.uniform(0.9, 1.1)
+
+        return self.frequency.clamp(timedelta(seconds=interval))
+
+    async def schedule(self, session: AsyncSession):
+        # same as delay(), with optional adaptive delay & load leveling
+        if self.frequency == Frequency.NEVER:
+            return self.delay()
+
+        delay = None
+        if settings.ADAPTIVE_POLLING:
+            delay = await self.adaptive_delay(session)
+        if delay is None:
+            delay = self.frequency.delay()
+
+        now = datetime.now()
+        self._delayed = now + delay
+        if settings.SLOTS_ENABLED:
+            low, high = self.frequency.bounds()
+            self._delayed = await Slots.allocate(
+                target=self._delayed,
+                earliest=now + low,
+                latest=now + high,
+                session=session,
+                feed_id=self._id,
+            )
+
     ##########################
     # FEED PARSING LOGIC BELOW
     ##########################
 
-    # filter is used to remove unnecessary items
-    # {field}        - don't skip what's mentioned there
-    # {field}_ignore - skip these ones
-    # in case of future review:
-    # SELECT _id, title, json FROM feed_updates.feed WHERE json ? 'filter'
+    # see FeedFilter for filter format
     def update_filter(self, update):
-        # adding it to make code more readable
-        KEEP = True
-        SUPPORTED_FIELDS = ["name", "href"]
-
-        if "filter" not in self.json:
-            return KEEP
-
-        for filter_name, filter_value in self.json["filter"].items():
-            if isinstance(filter_value, str):
-                filter_value = [filter_value]
-
-            if not isinstance(filter_value, list):
-                raise TypeError("Filter value is expected to be STR or LIST")
-
-            if "_ignore" not in filter_name:
-                field_value = getattr(update, filter_name)
-            else:
-                field_value = getattr(update, filter_name.replace("_ignore", ""))
-
-            # replace with python filter?
-            for each_value in filter_value:
-                if filter_name in SUPPORTED_FIELDS and each_value not in field_value:
-                    return not KEEP
-                elif (
-                    "_ignore" in filter_name
-                    and filter_name.replace("_ignore", "") in SUPPORTED_FIELDS
-                    and each_value in field_value
-                ):
-                    return not KEEP
-
-        return KEEP
+        return FeedFilter.from_json(self.json)(update)
 
     # ingest => add to database
     # notify => send as notification
@@ -235,46 +441,138 @@ class Feed(Base):
         updates: list["Update"],
         session: AsyncSession,
     ) -> list[dict]:
+        # circular import: Update model imports Feed
+        from models.model_updates import Update
+
         notify = []
         ingested = []
-        self_updates = await self.awaitable_attrs.updates
 
         # sort updates and limit amount
         updates.sort(key=lambda x: x.datetime, reverse=False)
         if isinstance(self.json.get("limit", None), int):
             updates = updates[: self.json["limit"]]
 
-        for each_update in filter(self.update_filter, updates):
-            # checking if href is present in DB
-            if not self_updates:
-                each_update.dt_event_adjust_first()
-            elif each_update.href not in [x.href for x in self_updates]:
-                each_update.dt_now()
-                notify.append(each_update)
-            else:
-                continue
+        # one update per href, the oldest one wins
+        candidates = {}
+        for each_update in filter(FeedFilter.from_json(self.json), updates):
+            candidates.setdefault(each_update.href, each_update)
+        candidates = list(candidates.values())
+
+        if candidates:
+            # feed without updates gets everything moved to the past
+            is_first = not await session.scalar(
+                select(exists().where(Update.feed_id == self._id))
+            )
+            for each_update in candidates:
+                if is_first:
+                    each_update.dt_event_adjust_first()
+                else:
+                    each_update.dt_now()
+
+            # only incoming hrefs are checked against DB,
+            # existing ones are skipped by (feed_id, href) unique constraint
+            query = (
+                insert(Update)
+                .on_conflict_do_nothing(index_elements=["feed_id", "href"])
+                .returning(Update.id, Update.href, Update.dt_created)
+            )
+            inserted = await session.execute(
+                query,
+                [
+                    {
+                        "feed_id": self._id,
+                        "name": x.name,
+                        "href": x.href,
+                        "dt_event": x.dt_event,
+                        "dt_original": x.dt_original,
+                    }
+                    for x in candidates
+                ],
+            )
+            inserted = {x.href: x for x in inserted}
 
-            session.add(each_update)
-            ingested.append(each_update)
+            for each_update in candidates:
+                if each_update.href not in inserted:
+                    # already present in DB
+                    continue
 
-        self.delay()
+                each_update.feed_id = self._id
+                each_update.id = inserted[each_update.href].id
+                each_update.dt_created = inserted[each_update.href].dt_created
+                ingested.append(each_update)
+                if not is_first:
+                    notify.append(each_update)
+
+        await self.schedule(session)
         session.add(self)
 
         if notify:
-            await TelegramService.send_feed_updates(
+            # sent later by Notification.drain(), outside of this transaction
+            Notification.enqueue(
                 feed=self,
                 updates=notify,
+                session=session,
             )
 
+        Metrics.INGEST_RECEIVED.inc(len(updates))
+        Metrics.INGEST_INGESTED.inc(len(ingested))
+
         return [x.as_dict() for x in ingested]
 
+    @classmethod
+    async def ingest_updates_bulk(
+        cls,
+        updates: dict[int, list["Update"]],
+    ) -> list[dict]:
+        results = []
+        feed_ids = list(updates)
+
+        # every batch of feeds is committed separately
+        for i in range(0, len(feed_ids), settings.INGEST_BATCH_FEEDS):
+            batch = feed_ids[i : i + settings.INGEST_BATCH_FEEDS]
+
+            async with SQLAlchemy.session_scope() as session:
+                query = select(cls).where(cls._id.in_(batch))
+                feeds = await SQLAlchemy.execute_all(
+                    query=query,
+                    session=session,
+                )
+                feeds = {x._id: x for x in feeds}
+
+                for feed_id in batch:
+                    result = {
+                        "feed_id": feed_id,
+                        "success": False,
+                        "received": len(updates[feed_id]),
+                    }
+                    results.append(result)
+
+                    if feed_id not in feeds:
+                        result["description"] = "Feed not found"
+                        continue
+
+                    try:
+                        # failed feed does not roll back the whole batch
+                        async with session.begin_nested():
+                            ingested = await feeds[feed_id].ingest_updates(
+                                updates=updates[feed_id],
+                                session=session,
+                            )
+                    except Exception as e:
+                        logger.warning(f"Bulk ingest failed for {feed_id=}: {e}")
+                        result["description"] = str(e)
+                        continue
+
+                    result["success"] = True
+                    result["ingested"] = len(ingested)
+
+            await ResponseCache.invalidate()
+
+        return results
+
     @staticmethod
     async def parse_href(href: str) -> "Feed":
-        URL = f"{ settings.SWAMP_PARSER }/parse/explained?href={href}"
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(URL) as response:
-                results = await response.json()
-                results["frequency"] = results["frequency"].upper()
+        results = await SwampParser.get_json("/parse/explained", href=href)
+        results["frequency"] = results["frequency"].upper()
 
         return Feed(**results)
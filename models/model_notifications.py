@@ -0,0 +1,157 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+import telegram
+from sqlalchemy import (
+    ForeignKey,
+    func,
+    Integer,
+    JSON,
+    select,
+    String,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import (
+    Mapped,
+    mapped_column,
+)
+
+from config.settings import settings
+from models.model_base import Base
+from services.service_sqlalchemy import SQLAlchemy
+from services.service_telegram import TelegramService
+
+
+logger = logging.getLogger(__name__)
+
+
+# outbox of telegram messages:
+# ingest stores them in the same transaction, worker sends them later
+class Notification(Base):
+    # CREATE TABLE feed_updates.notification (id SERIAL PRIMARY KEY, feed_id INTEGER NOT NULL REFERENCES feed_updates.feed (_id) ON DELETE CASCADE, messages JSON NOT NULL, sent_parts INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, last_error VARCHAR(500), dt_created TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), dt_next_attempt TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), dt_sent TIMESTAMP WITHOUT TIME ZONE);
+    # CREATE INDEX notification_pending_index ON feed_updates.notification (dt_next_attempt) WHERE dt_sent IS NULL;
+
+    __tablename__ = "notification"
+
+    id: Mapped[int] = mapped_column(
+        Integer,
+        primary_key=True,
+        autoincrement=True,
+    )
+    feed_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "feed_updates.feed._id",
+            ondelete="CASCADE",
+        ),
+        nullable=False,
+    )
+    # messages are rendered on enqueue, long ones are split into parts
+    messages: Mapped[list] = mapped_column(
+        JSON,
+        nullable=False,
+    )
+    sent_parts: Mapped[int] = mapped_column(
+        default=0,
+    )
+    attempts: Mapped[int] = mapped_column(
+        default=0,
+    )
+    last_error: Mapped[Optional[str]] = mapped_column(
+        String(500),
+        nullable=True,
+    )
+    dt_created: Mapped[datetime] = mapped_column(
+        insert_default=func.now(),
+    )
+    dt_next_attempt: Mapped[datetime] = mapped_column(
+        insert_default=func.now(),
+    )
+    dt_sent: Mapped[Optional[datetime]] = mapped_column(
+        nullable=True,
+    )
+
+    @classmethod
+    def enqueue(cls, feed, updates: list, session: AsyncSession):
+        if settings.TELEGRAM_BROADCAST is not True:
+            return
+
+        session.add(
+            cls(
+                feed_id=feed._id,
+                messages=TelegramService.format_feed_updates(
+                    feed=feed,
+                    updates=updates,
+                ),
+            )
+        )
+
+    def retry_later(self, error: Exception, seconds: float = None):
+        # delay given by server (flood control) is not a failed attempt,
+        # otherwise throttling alone would use up all attempts
+        self.last_error = repr(error)[:500]
+        if seconds is None:
+            self.attempts += 1
+            # exponential backoff
+            seconds = min(
+                settings.TELEGRAM_OUTBOX_BACKOFF * 2 ** (self.attempts - 1),
+                settings.TELEGRAM_OUTBOX_BACKOFF_MAX,
+            )
+        self.dt_next_attempt = func.now() + timedelta(seconds=seconds)
+
+    async def send(self):
+        # parts sent before failure are not sent again
+        for message in self.messages[self.sent_parts :]:
+            await TelegramService.send_message(message)
+            self.sent_parts += 1
+
+        self.dt_sent = func.now()
+
+    @classmethod
+    async def drain(cls) -> dict:
+        sent = 0
+        failed = 0
+
+        while True:
+            async with SQLAlchemy.session_scope() as session:
+                # one at a time, with progress committed after each of them
+                query = (
+                    select(cls)
+                    .where(
+                        cls.dt_sent.is_(None),
+                        cls.dt_next_attempt <= func.now(),
+                        cls.attempts < settings.TELEGRAM_OUTBOX_ATTEMPTS,
+                    )
+                    .order_by(cls.id)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                )
+                notification = await SQLAlchemy.execute_first(
+                    query=query,
+                    session=session,
+                )
+                if notification is None:
+                    break
+
+                try:
+                    await notification.send()
+                    sent += 1
+                except telegram.error.RetryAfter as e:
+                    # flood control, nothing else can be sent for now
+                    notification.retry_later(e, seconds=e.retry_after)
+                    failed += 1
+                    break
+                except telegram.error.TelegramError as e:
+                    logger.warning(f"Notification {notification.id} failed: {e}")
+                    notification.retry_later(e)
+                    failed += 1
+                except Exception as e:
+                    logger.exception(f"Notification {notification.id} failed")
+                    notification.retry_later(e)
+                    failed += 1
+                finally:
+                    # sent_parts is stored whatever happened, even on shutdown,
+                    # so parts that were delivered are not sent again
+                    await session.commit()
+
+        return {"sent": sent, "failed": failed}
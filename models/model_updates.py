@@ -1,11 +1,10 @@
 from typing import Optional
+import base64
 import datetime as dt
+import json
 import logging
 from datetime import timedelta
-from zoneinfo import ZoneInfo
 
-import aiohttp
-import emoji
 from sqlalchemy import (
     DateTime,
     ForeignKey,
@@ -13,6 +12,7 @@ from sqlalchemy import (
     Integer,
     select,
     String,
+    tuple_,
     UniqueConstraint,
 )
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -25,6 +25,8 @@ from sqlalchemy.orm import (
 from config.settings import settings
 from models.model_base import Base
 from models.model_feeds import Feed
+from services.service_normalize import Normalizer
+from services.service_parser import SwampParser
 from services.service_sqlalchemy import SQLAlchemy
 
 
@@ -34,6 +36,7 @@ logger = logging.getLogger(__name__)
 class Update(Base):
     # CREATE INDEX update_dt_event_desc_index ON feed_updates.update (dt_event DESC NULLS LAST);
     # CREATE INDEX update_feed_id ON feed_updates.update (feed_id);
+    # CREATE INDEX update_feed_id_dt_original_index ON feed_updates.update (feed_id, dt_original DESC);
     # REINDEX (verbose, concurrently) TABLE feed_updates.update;
 
     __tablename__ = "update"
@@ -99,34 +102,38 @@ class Update(Base):
         datetime: str,
         href: str,
         feed_id: int = None,
+        *,
+        normalized: bool = False,
     ):
-        # name
-        # transforming emojis to normal words:s
-        name = emoji.demojize(name, delimiters=(" ", " "))
-        name = name.replace("#", " ")  # removing hashtags
-        name = name.replace("_", " ")  # underscores are just weird spaces
-        name = " ".join(name.strip().split(" "))  # avoiding extra spaces
-        if not name:
-            # commenting out to not resolve circular import error
-            # feed_title = db.session.query(Feed).filter_by(
-            #     _id=feed_id
-            # ).first().title
-            # name = f"No name in update by { feed_title }"
-            name = "No name in update"
-
-        # datetime
-        if isinstance(datetime, str):
-            datetime = dt.datetime.fromisoformat(datetime)
-        else:
-            raise ValueError("Update.__init__() datetime is expected to be str")
-        datetime = self.zone_fix(datetime)
+        # values from Normalizer.batch() are already normalized
+        if not normalized:
+            name = Normalizer.name(name)
+            datetime = Normalizer.datetime(datetime)
+            href = href[:300]
 
-        self.name = name[:300]
-        self.href = href[:300]
+        self.name = name
+        self.href = href
         self.dt_event = datetime
         self.dt_original = datetime
         self.feed_id = feed_id
 
+    @classmethod
+    async def from_dicts(
+        cls,
+        items: list[dict],
+        feed_id: int = None,
+    ) -> list["Update"]:
+        return [
+            cls(
+                name=name,
+                datetime=datetime,
+                href=href,
+                feed_id=feed_id,
+                normalized=True,
+            )
+            for name, datetime, href in await Normalizer.batch_async(items)
+        ]
+
     def as_dict(self):
         return {
             # DATA STRUCTURE
@@ -147,34 +154,50 @@ class Update(Base):
 
     @staticmethod
     def zone_fix(datetime):
-        if datetime.tzinfo:
-            # if tzinfo present — convert to current one
-            return datetime.astimezone(ZoneInfo(settings.TIMEZONE_LOCAL))
-        else:
-            # if no tzinfo — replace it with current one
-            return datetime.replace(tzinfo=ZoneInfo(settings.TIMEZONE_LOCAL))
+        return Normalizer.zone_fix(datetime)
 
     def dt_now(self):
-        self.dt_event = self.zone_fix(
-            dt.datetime.now(ZoneInfo(settings.TIMEZONE_LOCAL))
-        )
+        self.dt_event = dt.datetime.now(Normalizer.timezone())
 
     def dt_event_adjust_first(self):
-        now = self.zone_fix(dt.datetime.now(ZoneInfo(settings.TIMEZONE_LOCAL)))
+        now = dt.datetime.now(Normalizer.timezone())
         a_week_ago = now - timedelta(days=7)
 
         # all recent events are moved to the past to avoid confusion
         if self.dt_event > a_week_ago:
             self.dt_event = a_week_ago
 
+    # cursors are opaque to clients: base64 of [dt_event, id]
+    @staticmethod
+    def cursor_encode(dt_event: dt.datetime, update_id: int) -> str:
+        cursor = json.dumps([dt_event.isoformat(), update_id])
+        return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
     @classmethod
-    async def get_updates(
-        cls,
-        limit: Optional[int],
-        private: Optional[bool],
-        _id: Optional[int],
-        session: AsyncSession,
-    ) -> list:
+    def cursor_since(cls, dt_event: dt.datetime, update_id: int) -> str:
+        # dt_event is stamped on ingest, but row is visible only after commit,
+        # so rows older than newest one sent can still appear: cursor stays
+        # UPDATES_SINCE_LAG behind now, clients dedupe repeated rows by id
+        if dt_event.tzinfo is None:
+            dt_event = dt_event.replace(tzinfo=dt.timezone.utc)
+        held = dt.datetime.now(dt.timezone.utc) - timedelta(
+            seconds=settings.UPDATES_SINCE_LAG
+        )
+        if dt_event > held:
+            dt_event, update_id = held, 0
+
+        return cls.cursor_encode(dt_event, update_id)
+
+    @staticmethod
+    def cursor_decode(cursor: str) -> tuple[dt.datetime, int]:
+        try:
+            dt_event, update_id = json.loads(base64.urlsafe_b64decode(cursor))
+            return dt.datetime.fromisoformat(dt_event), int(update_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Cursor {cursor} is not valid") from e
+
+    @classmethod
+    def query_updates(cls, private: Optional[bool], _id: Optional[int]):
         # prepare appropriate feeds as subquery
         subquery_feed_ids = select(Feed._id)
         if _id is not None:
@@ -182,17 +205,46 @@ class Update(Base):
         if private is not None:
             subquery_feed_ids = subquery_feed_ids.where(Feed.private == private)
 
+        return select(cls).where(cls.feed_id.in_(subquery_feed_ids))
+
+    @classmethod
+    async def get_updates(
+        cls,
+        limit: Optional[int],
+        private: Optional[bool],
+        _id: Optional[int],
+        session: AsyncSession,
+        before: Optional[tuple[dt.datetime, int]] = None,
+        since: Optional[tuple[dt.datetime, int]] = None,
+        normalize: bool = False,
+        feed_fields: Optional[list[str]] = None,
+    ) -> list | dict:
         # prepare updates as main query
-        query_updates = (
-            select(cls)
-            .where(cls.feed_id.in_(subquery_feed_ids))
-            .order_by(cls.dt_event.desc())
-            .limit(limit)
-        )
+        # plain dt_event conditions next to row comparisons
+        # are there to let postgres use dt_event index
+        query_updates = cls.query_updates(private=private, _id=_id)
+        if before is not None:
+            query_updates = query_updates.where(
+                cls.dt_event <= before[0],
+                tuple_(cls.dt_event, cls.id) < before,
+            )
+        if since is not None:
+            # oldest first, so newer rows are fetched without gaps
+            query_updates = query_updates.where(
+                cls.dt_event >= since[0],
+                tuple_(cls.dt_event, cls.id) > since,
+            ).order_by(cls.dt_event.asc(), cls.id.asc())
+        else:
+            query_updates = query_updates.order_by(cls.dt_event.desc(), cls.id.desc())
+        query_updates = query_updates.limit(limit)
+
         updates = await SQLAlchemy.execute_all(
             query=query_updates,
             session=session,
         )
+        if since is not None:
+            # response is always newest first
+            updates = updates[::-1]
 
         # prepare feed data as secondary query
         query_feed_data = select(Feed)
@@ -204,6 +256,18 @@ class Update(Base):
             session=session,
         )
         feed_data = {x._id: x.as_dict() for x in feed_data}
+        if feed_fields is not None:
+            feed_data = {
+                feed_id: {field: feed[field] for field in feed_fields}
+                for feed_id, feed in feed_data.items()
+            }
+
+        if normalize:
+            # each feed is sent once instead of once per update
+            return {
+                "updates": [x.as_dict() for x in updates],
+                "feeds": feed_data,
+            }
 
         results = []
         for each_update in updates:
@@ -214,21 +278,7 @@ class Update(Base):
         return results
 
     @staticmethod
-    async def parse_href(href: str) -> list["Update"]:
-        URL = f"{ settings.SWAMP_PARSER }/parse/updates?href={href}"
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(URL) as response:
-                results = await response.json()
-
-        updates = [
-            Update(
-                name=x["name"],
-                href=x["href"],
-                datetime=x["datetime"],
-                feed_id=None,
-            ).as_dict()
-            for x in results
-        ]
+    async def parse_href(href: str, feed_id: int = None) -> list["Update"]:
+        results = await SwampParser.get_json("/parse/updates", href=href)
 
-        return updates
+        return await Update.from_dicts(results, feed_id=feed_id)
@@ -6,7 +6,7 @@ import jwt
 from argon2 import exceptions as argon2_exceptions, PasswordHasher
 from fastapi import HTTPException, Request, status
 
-from services.service_cache import Cache
+from services.service_cache import Cache, StrCodec
 
 
 logger = logging.getLogger(__name__)
@@ -14,6 +14,8 @@ logger = logging.getLogger(__name__)
 
 # not a full fledged model, just for admin's auth
 class User:
+    CACHE_KEY_TOKEN = Cache.key("auth", "admin-access-token")
+
     @classmethod
     def generate_password(cls) -> bytes:
         environ["ADMIN_HASH"] = PasswordHasher().hash(getenv("ADMIN_PASS"))
@@ -47,8 +49,10 @@ class User:
 
         access_token = jwt.encode(to_encode, getenv("SECRET_KEY"), algorithm="HS256")
         await Cache.set(
-            timeout={"days": expires_days},
+            key=cls.CACHE_KEY_TOKEN,
             value=access_token,
+            ttl=timedelta(days=expires_days),
+            codec=StrCodec,
         )
 
         return access_token
@@ -65,7 +69,7 @@ class User:
         except jwt.PyJWTError:
             return False
 
-        cached_token = await Cache.get()
+        cached_token = await Cache.get(User.CACHE_KEY_TOKEN, codec=StrCodec)
         if cached_token != token:
             return False
 
@@ -0,0 +1,44 @@
+import datetime
+import enum
+import json
+import typing
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is used instead
+    orjson = None
+
+
+def encode_default(value: typing.Any):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, enum.Enum):
+        return value.value
+
+    return str(value)
+
+
+class CompactJsonResponse(Response):
+    media_type = "application/json"
+
+    @staticmethod
+    def dumps(content: typing.Any) -> bytes:
+        if orjson is not None:
+            # datetime and enum are encoded natively
+            return orjson.dumps(
+                content,
+                default=encode_default,
+                option=orjson.OPT_NON_STR_KEYS,
+            )
+
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+            default=encode_default,
+        ).encode("utf-8")
+
+    def render(self, content: typing.Any) -> bytes:
+        return self.dumps(content)
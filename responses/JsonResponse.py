@@ -0,0 +1,43 @@
+import typing
+from contextvars import ContextVar
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+
+from responses.CompactJsonResponse import CompactJsonResponse
+from responses.PrettyJsonResponse import PrettyJsonResponse
+from services.service_query_stats import QueryStats
+
+
+# picks compact or pretty output depending on what client asked for:
+# ?format=compact or "Accept: application/json; format=compact"
+class JsonResponse(Response):
+    media_type = "application/json"
+    compact: ContextVar[bool] = ContextVar("compact", default=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers.setdefault("vary", "Accept")
+
+    def render(self, content: typing.Any) -> bytes:
+        with QueryStats.serializing():
+            if self.compact.get():
+                return CompactJsonResponse.dumps(content)
+
+            # content returned as JsonResponse skips FastAPI's encoding,
+            # so pretty output is encoded here the same way it was before
+            return PrettyJsonResponse.render(self, jsonable_encoder(content))
+
+    @staticmethod
+    def is_compact(request: Request) -> bool:
+        output_format = request.query_params.get("format")
+        if output_format is None:
+            accept = request.headers.get("accept", "").replace(" ", "").lower()
+            output_format = "compact" if "format=compact" in accept else "pretty"
+
+        return output_format == "compact"
+
+    @classmethod
+    async def negotiate(cls, request: Request):
+        cls.compact.set(cls.is_compact(request))
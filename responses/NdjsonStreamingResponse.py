@@ -0,0 +1,52 @@
+import typing
+from contextlib import aclosing
+
+import anyio
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from responses.CompactJsonResponse import CompactJsonResponse
+
+
+# newline-delimited JSON, one row per line, sent in chunks of rows
+class NdjsonStreamingResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+    CHUNK_ROWS = 500
+
+    def __init__(
+        self,
+        rows: typing.AsyncIterable,
+        serialize: typing.Callable[[typing.Any], dict] = None,
+        **kwargs,
+    ):
+        # rows are passed as is, not wrapped in generator expression,
+        # so closing response closes them (and their DB session) too
+        super().__init__(self.encode(rows, serialize), **kwargs)
+
+    @classmethod
+    async def encode(
+        cls,
+        rows: typing.AsyncIterable,
+        serialize: typing.Callable[[typing.Any], dict] = None,
+    ):
+        chunk = []
+        async with aclosing(rows):
+            async for row in rows:
+                if serialize is not None:
+                    row = serialize(row)
+                chunk.append(CompactJsonResponse.dumps(row))
+                if len(chunk) >= cls.CHUNK_ROWS:
+                    yield b"\n".join(chunk) + b"\n"
+                    chunk = []
+
+        if chunk:
+            yield b"\n".join(chunk) + b"\n"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # client disconnected midway: rows are closed right away,
+            # instead of staying suspended until garbage collection
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
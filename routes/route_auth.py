@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 
 from models.model_users import User
-from responses.PrettyJsonResponse import PrettyJsonResponse
+from responses.JsonResponse import JsonResponse
 
 
 router = APIRouter(
@@ -11,7 +11,7 @@ router = APIRouter(
 
 
 # curl -F username=XXXX -F password=XXXX "http://localhost:34001/auth/login/"
-@router.post("/login/", response_class=PrettyJsonResponse)
+@router.post("/login/", response_class=JsonResponse)
 async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
     EXPIRATION_DAYS = 7
 
@@ -42,7 +42,7 @@ async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depen
 
 @router.get(
     "/verify/",
-    response_class=PrettyJsonResponse,
+    response_class=JsonResponse,
     dependencies=[Depends(User.admin_only)],
 )
 async def verify():
@@ -1,17 +1,26 @@
 import logging
+from collections import defaultdict
+from datetime import timedelta
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError as sqlalchemy_IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config.scheduler import scheduler
+from config.settings import settings
 from models.model_feeds import Feed
+from models.model_notifications import Notification
 from models.model_updates import Update
 from models.model_users import User
-from responses.PrettyJsonResponse import PrettyJsonResponse
+from responses.JsonResponse import JsonResponse
+from responses.NdjsonStreamingResponse import NdjsonStreamingResponse
 from services.service_backups import Backup
-from services.service_frequency import Frequency
+from services.service_import import ImportJob
+from services.service_leader import Leader
+from services.service_ndjson import Ndjson
+from services.service_refresh import Refresh
+from services.service_response_cache import ResponseCache
 from services.service_sqlalchemy import SQLAlchemy
 
 
@@ -23,31 +32,40 @@ router = APIRouter(
 )
 
 
-@router.get("/", response_class=PrettyJsonResponse)
-async def list_feeds(
-    requires_update: bool = None,
-    active: bool = None,
-    session: AsyncSession = Depends(SQLAlchemy.get_db_session),
-    # TODO: replace requires_update & active with mode argument
-):
+def query_feeds(requires_update: bool = None, active: bool = None):
     query = select(Feed)
 
     if requires_update is True:
         query = Feed.query_requires_update(query)
     if active is True:
-        query = query.where(Feed.frequency != Frequency.NEVER)
+        query = query.where(Feed.is_active())
+
+    return query
+
+
+@router.get("/", response_class=JsonResponse)
+async def list_feeds(
+    requires_update: bool = None,
+    active: bool = None,
+    session: AsyncSession = Depends(SQLAlchemy.get_db_session_readonly),
+    # TODO: replace requires_update & active with mode argument
+):
+    query = query_feeds(
+        requires_update=requires_update,
+        active=active,
+    )
 
     feeds = await SQLAlchemy.execute_all(
         query=query,
         session=session,
     )
 
-    return [feed.as_dict() for feed in feeds]
+    return JsonResponse([feed.as_dict() for feed in feeds])
 
 
 @router.put(
     "/",
-    response_class=PrettyJsonResponse,
+    response_class=JsonResponse,
     dependencies=[Depends(User.admin_only)],
 )
 async def create_feed(
@@ -59,11 +77,146 @@ async def create_feed(
     session.add(feed)
     await session.commit()
     await session.refresh(feed)
+    await ResponseCache.invalidate()
 
     return feed.as_dict()
 
 
-@router.get("/parse/", response_class=PrettyJsonResponse)
+# curl "http://localhost:34001/feeds/export/" > feeds.ndjson
+@router.get(
+    "/export/",
+    response_class=NdjsonStreamingResponse,
+    dependencies=[Depends(User.admin_only)],
+)
+async def export_feeds(
+    requires_update: bool = None,
+    active: bool = None,
+):
+    query = query_feeds(
+        requires_update=requires_update,
+        active=active,
+    ).order_by(Feed._id)
+
+    return NdjsonStreamingResponse(
+        SQLAlchemy.stream_all(query),
+        serialize=Feed.as_dict,
+    )
+
+
+@router.post(
+    "/refresh/",
+    response_class=JsonResponse,
+    dependencies=[Depends(User.admin_only)],
+)
+async def refresh_feeds():
+    return await Refresh.run()
+
+
+# for external workers: leased feeds are returned only once per lease,
+# POST /feeds/{feed_id}/ with updates schedules next poll
+@router.post(
+    "/claim/",
+    response_class=JsonResponse,
+    dependencies=[Depends(User.admin_only)],
+)
+async def claim_feeds(
+    limit: int = 100,
+    lease_minutes: int = settings.REFRESH_LEASE_MINUTES,
+    session: AsyncSession = Depends(SQLAlchemy.get_db_session),
+):
+    feeds = await Feed.claim(
+        limit=limit,
+        lease=timedelta(minutes=lease_minutes),
+        session=session,
+    )
+    await session.commit()
+    await ResponseCache.invalidate()
+
+    return JsonResponse([{"_id": x._id, "href": x.href} for x in feeds])
+
+
+# curl -X POST "http://localhost:34001/feeds/import/" \
+#     -H "Content-Type: application/json" -d '["https://...", "https://..."]'
+@router.post(
+    "/import/",
+    response_class=JsonResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(User.admin_only)],
+)
+async def import_feeds(hrefs: list[str]):
+    return await ImportJob.submit(hrefs)
+
+
+@router.get(
+    "/import/{job_id}/",
+    response_class=JsonResponse,
+    dependencies=[Depends(User.admin_only)],
+)
+async def read_import(job_id: str):
+    job = await ImportJob.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Import job {job_id} not found",
+        )
+
+    return JsonResponse(job)
+
+
+async def ingest_rows(feed_ids: list[int], rows: list[dict], results: dict):
+    # one batch of request body, results of the same feed are merged
+    updates = defaultdict(list)
+    for feed_id, each_update in zip(feed_ids, await Update.from_dicts(rows)):
+        each_update.feed_id = feed_id
+        updates[feed_id].append(each_update)
+
+    for result in await Feed.ingest_updates_bulk(updates):
+        previous = results.setdefault(result["feed_id"], result)
+        if previous is result:
+            continue
+        previous["received"] += result["received"]
+        if "ingested" in result:
+            previous["ingested"] = previous.get("ingested", 0) + result["ingested"]
+        if not result["success"]:
+            previous["success"] = False
+            previous["description"] = result["description"]
+
+
+# one update per line, updates of many feeds in one request:
+# {"feed_id": 1, "name": "...", "href": "...", "datetime": "..."}
+# curl -X POST "http://localhost:34001/feeds/ingest/" \
+#     -H "Content-Encoding: gzip" --data-binary @updates.ndjson.gz
+# body is ingested in batches while it is received, so batches before
+# an invalid line are already stored; existing updates are skipped,
+# so the same request can be sent again
+@router.post("/ingest/", response_class=JsonResponse)
+async def push_updates_bulk(request: Request):
+    results = {}
+    feed_ids = []
+    rows = []
+    try:
+        async for line_number, each in Ndjson.read(request):
+            try:
+                feed_ids.append(int(each["feed_id"]))
+                rows.append({x: each[x] for x in ("name", "href", "datetime")})
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Line {line_number} is not valid: {e!r}")
+
+            if len(rows) >= settings.INGEST_BATCH_ROWS:
+                await ingest_rows(feed_ids, rows, results)
+                feed_ids, rows = [], []
+        if rows:
+            await ingest_rows(feed_ids, rows, results)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+
+    return list(results.values())
+
+
+@router.get("/parse/", response_class=JsonResponse)
 async def explain_feed(
     href: str,
     mode: str = "explain",
@@ -84,31 +237,47 @@ async def explain_feed(
         feed = await Feed.parse_href(href)
 
     similar_feeds = await feed.get_similar_feeds(session)
+    duplicate = any(feed.is_duplicate(x) for x, _ in similar_feeds)
 
-    # if there are no similar feeds
+    # if there are no feeds with the same href
     # then we can add it to the database and ignore responses
-    if mode == "explain":
-        pass
-    elif mode == "push" and not similar_feeds:
-        session.add(feed)
-    elif mode == "push_ignore":
+    pushed = False
+    description = None
+    if mode == "push" and duplicate:
+        description = "Feed with the same href already exists"
+    elif mode in ("push", "push_ignore"):
         try:
-            session.add(feed)
-        except sqlalchemy_IntegrityError:
-            # ignoring it as expected behaviour:
-            # push_ignore is exactly to ignore this error
-            pass
+            # other unique constraints (title) are only found on insert
+            async with session.begin_nested():
+                session.add(feed)
+                await session.flush()
+        except sqlalchemy_IntegrityError as e:
+            # push_ignore is exactly to ignore this error, still reported
+            description = f"Feed was not added: {e.orig}"
+        else:
+            await session.commit()
+            await ResponseCache.invalidate()
+            pushed = True
 
     return {
         "explained": feed.as_dict(),
-        "similar_feeds": [x.as_dict() for x in similar_feeds],
+        "pushed": pushed,
+        "description": description,
+        "similar_feeds": [
+            {
+                **x.as_dict(),
+                "similarity": similarity,
+                "duplicate": feed.is_duplicate(x),
+            }
+            for x, similarity in similar_feeds
+        ],
     }
 
 
-@router.get("/{feed_id}/", response_class=PrettyJsonResponse)
+@router.get("/{feed_id}/", response_class=JsonResponse)
 async def read_feed(
     feed_id: int,
-    session: AsyncSession = Depends(SQLAlchemy.get_db_session),
+    session: AsyncSession = Depends(SQLAlchemy.get_db_session_readonly),
 ):
     query = select(Feed).where(Feed._id == feed_id)
     feed = await SQLAlchemy.execute_first(
@@ -116,12 +285,12 @@ async def read_feed(
         session=session,
     )
 
-    return feed.as_dict()
+    return JsonResponse(feed.as_dict())
 
 
 @router.put(
     "/{feed_id}/",
-    response_class=PrettyJsonResponse,
+    response_class=JsonResponse,
     dependencies=[Depends(User.admin_only)],
 )
 async def update_feed(
@@ -142,13 +311,15 @@ async def update_feed(
         )
 
     session.add(feed)
+    await session.commit()
+    await ResponseCache.invalidate()
 
     return feed.as_dict()
 
 
 @router.delete(
     "/{feed_id}/",
-    response_class=PrettyJsonResponse,
+    response_class=JsonResponse,
     dependencies=[Depends(User.admin_only)],
 )
 async def delete_feed(
@@ -163,13 +334,15 @@ async def delete_feed(
 
     session.add(feed)
     await session.delete(feed)
+    await session.commit()
+    await ResponseCache.invalidate()
 
     return {
         "success": True,
     }
 
 
-@router.post("/{feed_id}/", response_class=PrettyJsonResponse)
+@router.post("/{feed_id}/", response_class=JsonResponse)
 async def push_updates(
     feed_id: int,
     updates: list[dict],
@@ -181,102 +354,56 @@ async def push_updates(
         query=query,
         session=session,
     )
-    updates = [Update(**x, feed_id=feed._id) for x in updates]
-
-    return await feed.ingest_updates(updates, session)
-
-
-# # It was used at some point, but it's not needed.
-# # Disabled as dangerous.
-# # curl -X GET "http://127.0.0.1:30010/feeds/parse/txt/"
-# @router.route("/parse/txt/", methods=["GET"])
-# async def parse_explain_from_txt():
-#     import os
-#     import re
-#     import time
-#     import random
-#     from sqlalchemy.orm import Session
-
-#     def str_denied(s):
-#         if not s.startswith("https://") and not s.startswith("http://"):
-#             return True
-#         elif "instagram.com/reel/" in s:
-#             return True
-#         elif "instagram.com/p/" in s:
-#             return True
-#         elif s.startswith("https://www.instagram.com/") or s.startswith("https://instagram.com/"):
-#             return False
-#         elif s.startswith("https://www.tiktok.com/@") and "/video/" in s:
-#             return True
-#         elif s.startswith("https://www.tiktok.com/@"):
-#             return False
-#         elif s.startswith("https://youtube.com/@"):
-#             return False
-#         elif s.startswith("https://www.youtube.com/channel/"):
-#             return False
-
-#         return True
-
-#     lines = set()
-#     with open("2_unique_lines.txt", "r", encoding="UTF-8") as f:
-#         file = f.read()
-
-#         for each in file.split("\n"):
-#             lines.add(each.strip())
-
-#     random.shuffle(list(lines))
-#     for line in lines:
-#         # https://www.instagram.com/romyrosemariekuester?igsh=MXJocXdoMTR0OXcyZg==
-#         # https://www.tiktok.com/@koval_l?_t=8q7aPhBPyx4
-#         # https://www.tiktok.com/@tinakross_massage?_t=ZM-8tGSEa3UiTG
-#         line = line.split("?igsh=")[0]
-#         line = line.split("?_t=")[0]
-#         if db.session.query(Feed).filter_by(href=line).count() > 0:
-#             with open("3_B_already_there.txt", "a", encoding="UTF-8") as f:
-#                 f.write(f"{line}\n")
-#             continue
-
-#         if str_denied(line):
-#             with open("3_A_denied.txt", "a", encoding="UTF-8") as f:
-#                 f.write(f"{line}\n")
-#         else:
-#             # print("APPROVED", line)
-#             if "instagram.com" in line:
-#                 time.sleep(random.randrange(15, 60))
-
-#             session = Session(db.engine)
-#             try:
-#                 feed = await Feed.parse_href(line)
-
-#                 if not feed.get_similar_feeds():
-#                     with session.begin():
-#                         session.add(feed)
-#                         session.commit()
-#                     with open("3_C_new", "a", encoding="UTF-8") as f:
-#                         f.write(f"{line}\n")
-#                         print("NEW", line)
-#                 else:
-#                     with open("3_B_already_there.txt", "a", encoding="UTF-8") as f:
-#                         f.write(f"{line}\n")
-#                         print("ALREADY THERE", line)
-#             except Exception as e:
-#                 with open("3_D_failed.txt", "a", encoding="UTF-8") as f:
-#                     f.write(f"{line}\n")
-#                 with open("3_E_failed_reasons.txt", "a", encoding="UTF-8") as f:
-#                     f.write(f"{line} {e}\n")
-#                     print("FAILED", line, e)
-#                 continue
-
-#     return shared.return_json("Success")
-
-
-# Generate backup of all feeds every 6 hours
-@scheduler.scheduled_job("cron", id="backup_generator", hour="*/6")
+    updates = await Update.from_dicts(updates, feed_id=feed._id)
+
+    ingested = await feed.ingest_updates(updates, session)
+    await session.commit()
+    await ResponseCache.invalidate()
+
+    return ingested
+
+
+# Refresh all feeds that require update
+@scheduler.scheduled_job(
+    "interval",
+    id="feed_refresh",
+    minutes=settings.REFRESH_INTERVAL_MINUTES,
+    coalesce=True,
+)
+async def refresh() -> dict:
+    if not settings.REFRESH_ENABLED:
+        return {"success": False, "description": "Refresh is disabled"}
+
+    return await Refresh.run()
+
+
+# Send telegram notifications queued by ingest
+@scheduler.scheduled_job(
+    "interval",
+    id="notification_sender",
+    seconds=settings.TELEGRAM_OUTBOX_INTERVAL,
+    coalesce=True,
+)
+@Leader.only
+async def send_notifications() -> dict:
+    return await Notification.drain()
+
+
+# Generate full backup of feeds and updates every day
+@scheduler.scheduled_job("cron", id="backup_generator", hour="0")
 # @router.route("/backup/", methods=["GET"])  # for testing purposes
-async def backup(session: AsyncSession = Depends(SQLAlchemy.get_db_session)) -> str:
-    # TODO: replace scheduler?
-    with scheduler.app.app_context():
-        backup_new = await Backup.dump(session=session)
+@Leader.only
+async def backup(incremental: bool = False) -> str:
+    # scheduled jobs are outside of requests, so no Depends() here
+    async with SQLAlchemy.session_scope() as session:
+        backup_new = await Backup.dump(session=session, incremental=incremental)
+
+    print(f"Generated backup {backup_new.filename}")
+    return backup_new.filename
+
 
-        print(f"Generated backup {backup_new.filename}")
-        return backup_new.filename
+# Generate incremental backups between full ones
+@scheduler.scheduled_job("cron", id="backup_incremental", hour="6,12,18")
+@Leader.only
+async def backup_incremental() -> str:
+    return await backup(incremental=True)
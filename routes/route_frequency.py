@@ -1,7 +1,10 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from responses.PrettyJsonResponse import PrettyJsonResponse
+from responses.JsonResponse import JsonResponse
 from services.service_frequency import Frequency
+from services.service_slots import Slots
+from services.service_sqlalchemy import SQLAlchemy
 
 
 router = APIRouter(
@@ -9,6 +12,15 @@ router = APIRouter(
 )
 
 
-@router.get("/", response_class=PrettyJsonResponse)
+@router.get("/", response_class=JsonResponse)
 def list_frequencies() -> list:
     return Frequency.list()
+
+
+# upcoming load: how many feeds are due in each slot
+@router.get("/histogram/", response_class=JsonResponse)
+async def slots_histogram(
+    hours: int = Query(default=24, gt=0, le=24 * 7),
+    session: AsyncSession = Depends(SQLAlchemy.get_db_session),
+):
+    return JsonResponse(await Slots.histogram(hours=hours, session=session))
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from models.model_users import User
+from responses.JsonResponse import JsonResponse
+from services.service_metrics import Metrics
+from services.service_sqlalchemy import SQLAlchemy
+
+
+router = APIRouter(
+    prefix="/status",
+)
+
+
+@router.get(
+    "/pool/",
+    response_class=JsonResponse,
+    dependencies=[Depends(User.admin_only)],
+)
+async def pool_status():
+    return SQLAlchemy.pool_stats()
+
+
+# Prometheus text format, for local scraping
+router_metrics = APIRouter()
+
+
+@router_metrics.get("/metrics", response_class=Response)
+async def metrics():
+    Metrics.update_pool(SQLAlchemy.pool_stats())
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
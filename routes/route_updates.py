@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from services.service_sqlalchemy import SQLAlchemy
+from models.model_feeds import Feed
 from models.model_updates import Update
-from responses.PrettyJsonResponse import PrettyJsonResponse
+from models.model_users import User
+from responses.JsonResponse import JsonResponse
+from responses.NdjsonStreamingResponse import NdjsonStreamingResponse
 
 
 router = APIRouter(
@@ -11,25 +14,92 @@ router = APIRouter(
 )
 
 
-@router.get("/", response_class=PrettyJsonResponse)
+@router.get("/", response_class=JsonResponse)
 async def list_updates(
     limit: int = 300,
     private: bool = None,
     # TODO: separate _id to its own endpoint  /feed/{feed_id}/updates ?
     _id: int = None,
-    session: AsyncSession = Depends(SQLAlchemy.get_db_session),
-) -> list:
-    return await Update.get_updates(
+    # cursors from X-Cursor-Before / X-Cursor-Since of previous responses,
+    # since can return rows sent before (see Update.cursor_since), dedupe by id
+    before: str = None,
+    since: str = None,
+    # normalize => {"updates": [...], "feeds": {feed_id: {...}}}
+    normalize: bool = False,
+    # comma-separated subset of feed fields, e.g. "_id,title,private"
+    feed_fields: str = None,
+    session: AsyncSession = Depends(SQLAlchemy.get_db_session_readonly),
+) -> JsonResponse:
+    try:
+        before = Update.cursor_decode(before) if before else None
+        since = Update.cursor_decode(since) if since else None
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+
+    if feed_fields is not None:
+        feed_fields = [x.strip() for x in feed_fields.split(",") if x.strip()]
+        unknown = set(feed_fields) - set(Feed.DICT_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown feed fields {sorted(unknown)}",
+            )
+
+    updates = await Update.get_updates(
         limit=limit,
         private=private,
         _id=_id,
         session=session,
+        before=before,
+        since=since,
+        normalize=normalize,
+        feed_fields=feed_fields,
+    )
+
+    rows = updates["updates"] if normalize else updates
+    headers = {}
+    if rows:
+        # older page & delta sync of newer items
+        oldest, newest = rows[-1], rows[0]
+        headers["X-Cursor-Before"] = Update.cursor_encode(
+            oldest["dt_event"], oldest["id"]
+        )
+        headers["X-Cursor-Since"] = Update.cursor_since(
+            newest["dt_event"], newest["id"]
+        )
+    elif since is not None:
+        # nothing new, keep polling with the same cursor
+        headers["X-Cursor-Since"] = Update.cursor_since(*since)
+
+    return JsonResponse(updates, headers=headers)
+
+
+# curl "http://localhost:34001/updates/export/" > updates.ndjson
+@router.get(
+    "/export/",
+    response_class=NdjsonStreamingResponse,
+    dependencies=[Depends(User.admin_only)],
+)
+async def export_updates(
+    private: bool = None,
+    _id: int = None,
+):
+    query = Update.query_updates(private=private, _id=_id).order_by(Update.id)
+
+    return NdjsonStreamingResponse(
+        SQLAlchemy.stream_all(query),
+        serialize=Update.as_dict,
     )
 
 
-@router.get("/parse/", response_class=PrettyJsonResponse)
+@router.get("/parse/", response_class=JsonResponse)
 async def parse_updates(
     href: str,
-) -> list:
-    return await Update.parse_href(href)
+) -> JsonResponse:
+    updates = await Update.parse_href(href)
+
+    return JsonResponse([x.as_dict() for x in updates])
     # TODO: return 422 if swamp-parser fails
@@ -1,12 +1,30 @@
 from contextlib import asynccontextmanager
 from os import getenv
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import sentry_sdk
 
+from config.scheduler import scheduler
 from models.model_users import User
-from routes import route_auth, route_feeds, route_frequency, route_updates
+from responses.JsonResponse import JsonResponse
+from routes import (
+    route_auth,
+    route_feeds,
+    route_frequency,
+    route_status,
+    route_updates,
+)
+from services.service_cache import Cache
+from services.service_import import ImportJob
+from services.service_leader import Leader
+from services.service_metrics import Metrics
+from services.service_normalize import Normalizer
+from services.service_parser import SwampParser
+from services.service_query_stats import QueryStats
+from services.service_response_cache import ResponseCache
+from services.service_sqlalchemy import SQLAlchemy
+from services.service_telegram import TelegramService
 
 
 sentry_sdk.init(
@@ -32,9 +50,21 @@ sentry_sdk.init(
 async def lifespan(app: FastAPI):
     # run on startup
     User.generate_password()
+    await Cache.open()
+    await SwampParser.open()
+    await Leader.open()
+    scheduler.start()
 
     yield
     # run on shutdown
+    scheduler.shutdown()
+    await ImportJob.close()
+    await SwampParser.close()
+    await Leader.release()
+    await Cache.close()
+    await SQLAlchemy.dispose()
+    await TelegramService.close()
+    Normalizer.close()
 
 
 # Initialize FastAPI app
@@ -45,11 +75,22 @@ app = FastAPI(
     """,
     version="V4",
     lifespan=lifespan,
+    dependencies=[Depends(JsonResponse.negotiate)],
 )
 app.include_router(route_auth.router)
 app.include_router(route_feeds.router)  # not in use for now
 app.include_router(route_frequency.router)
 app.include_router(route_updates.router)
+app.include_router(route_status.router)
+app.include_router(route_status.router_metrics)
+
+
+# added before CORS, so cached responses get CORS headers too
+app.middleware("http")(ResponseCache.middleware)
+# Server-Timing header with DB & serialization time of request
+app.middleware("http")(QueryStats.middleware)
+# outside of cache, so cached responses are measured too
+app.middleware("http")(Metrics.middleware)
 
 
 # CORS configuration
@@ -64,4 +105,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Cursor-Before", "X-Cursor-Since"],
 )
@@ -1,27 +1,72 @@
+import asyncio
+import gzip
+import hashlib
 import json
 import os
-from datetime import datetime
+from collections import Counter, defaultdict
+from contextlib import aclosing, closing
+from datetime import datetime, timedelta
+from typing import List
 
 from models.model_feeds import Feed
-from sqlalchemy import select
+from models.model_updates import Update
+from sqlalchemy import (
+    and_,
+    column,
+    DateTime,
+    Enum,
+    func,
+    select,
+    UniqueConstraint,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from services.service_sqlalchemy import SQLAlchemy
+from responses.CompactJsonResponse import CompactJsonResponse
 
 
 class Backup:
     BACKUP_LOCATION = "/backups"
+    # old backups: JSON list of feeds
     FILENAME_FORMAT = "%Y-%m-%d.json"
+    # current backups: gzipped NDJSON, {"table": ..., "row": {...}} per line
+    FILENAME_FORMAT_FULL = "%Y-%m-%dT%H-%M-%S.full.ndjson.gz"
+    FILENAME_FORMAT_INCREMENTAL = "%Y-%m-%dT%H-%M-%S.incremental.ndjson.gz"
+    # rows read from DB and written to file at once
+    BATCH_SIZE = 5000
+    # incremental backups overlap with previous ones to include rows
+    # from transactions that were still running during previous backup
+    INCREMENTAL_OVERLAP = timedelta(minutes=30)
+    # manifests of all backups, so listing them does not open backup files
+    INDEX_FILENAME = "index.json"
+    MANIFEST_SUFFIX = ".manifest.json"
+    # restore order matters: updates reference feeds
+    TABLES = {
+        "feed": Feed.__table__,
+        "update": Update.__table__,
+    }
+    # columns changed by app itself all the time, not part of backed up data
+    COMPARE_IGNORE = {
+        "feed": {"_delayed"},
+    }
+    COMPARE_IDS_LIMIT = 100
+    # dump & index updates of this process are done one at a time
+    lock = asyncio.Lock()
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, manifest: dict = None):
         if self.validate_name(filename):
             self.filename = filename
+            self.manifest = manifest
         else:
             raise RuntimeError(f"Generated {filename=} is wrong")
 
     def __repr__(self) -> str:
         return f"<Backup filename='{self.filename}'>"
 
+    def __lt__(self, other) -> bool:
+        return self.created < other.created
+
     @classmethod
     def today(cls):
         folder = cls.BACKUP_LOCATION
@@ -29,56 +74,240 @@ class Backup:
         return f"{folder}/{date}"
 
     @classmethod
-    def validate_name(cls, filename):
+    def parse_name(cls, filename) -> datetime | None:
         folder, file = filename.rsplit("/", 1)
 
         # check if filename is valid
         if folder != cls.BACKUP_LOCATION:
-            return False
+            return None
+        for filename_format in [
+            cls.FILENAME_FORMAT_FULL,
+            cls.FILENAME_FORMAT_INCREMENTAL,
+            cls.FILENAME_FORMAT,
+        ]:
+            try:
+                return datetime.strptime(file, filename_format)
+            except ValueError:
+                continue
+
+        return None
+
+    @classmethod
+    def validate_name(cls, filename):
+        return cls.parse_name(filename) is not None
+
+    @property
+    def created(self) -> datetime:
+        return self.parse_name(self.filename)
+
+    @property
+    def is_legacy(self) -> bool:
+        return self.filename.endswith(".json")
+
+    @property
+    def is_incremental(self) -> bool:
+        return ".incremental." in self.filename
+
+    @property
+    def kind(self) -> str:
+        if self.is_legacy:
+            return "legacy"
+        elif self.is_incremental:
+            return "incremental"
+        else:
+            return "full"
+
+    ##########################
+    # MANIFESTS & BACKUP INDEX
+    ##########################
+
+    # all methods in this section are blocking, run them in a thread
+
+    @classmethod
+    def index_path(cls) -> str:
+        return f"{ cls.BACKUP_LOCATION }/{ cls.INDEX_FILENAME }"
+
+    @staticmethod
+    def write_json(filename: str, data):
+        # atomic, readers never see partially written file
+        with open(f"{filename}.tmp", "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(f"{filename}.tmp", filename)
+
+    @classmethod
+    def read_index(cls) -> dict | None:
         try:
-            datetime.strptime(file, cls.FILENAME_FORMAT)
-        except ValueError:
+            with open(cls.index_path(), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def checksum(filename: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+
+        return sha256.hexdigest()
+
+    def make_manifest(self, rows: dict, since: datetime = None) -> dict:
+        return {
+            "filename": os.path.basename(self.filename),
+            "kind": self.kind,
+            "created": self.created.isoformat(),
+            "since": since.isoformat() if since else None,
+            "tables": list(rows),
+            "rows": rows,
+            "size": os.path.getsize(self.filename),
+            "sha256": self.checksum(self.filename),
+        }
+
+    def save_manifest(self):
+        self.write_json(f"{self.filename}{self.MANIFEST_SUFFIX}", self.manifest)
+
+        index = self.read_index() or {}
+        index[self.manifest["filename"]] = self.manifest
+        self.write_json(self.index_path(), index)
+
+    @classmethod
+    def reindex(cls) -> dict:
+        # rebuilds index from sidecar manifests,
+        # files without them (older backups) are read to create them
+        index = {}
+        for file in sorted(os.listdir(path=cls.BACKUP_LOCATION)):
+            filename = f"{ cls.BACKUP_LOCATION }/{ file }"
+            if not cls.validate_name(filename):
+                continue
+
+            backup = cls(filename=filename)
+            try:
+                with open(f"{filename}{cls.MANIFEST_SUFFIX}", "r") as f:
+                    backup.manifest = json.load(f)
+            except FileNotFoundError:
+                if not cls.validate_file(filename):
+                    continue
+                rows = Counter(table for table, _ in backup.read())
+                backup.manifest = backup.make_manifest(rows=dict(rows))
+                backup.write_json(f"{filename}{cls.MANIFEST_SUFFIX}", backup.manifest)
+
+            index[file] = backup.manifest
+
+        cls.write_json(cls.index_path(), index)
+
+        return index
+
+    def validate(self) -> bool:
+        # full validation: checksum from manifest and every row of the file
+        manifest = self.manifest
+        if manifest is None:
+            manifest = (self.read_index() or {}).get(os.path.basename(self.filename))
+        if manifest is not None and self.checksum(self.filename) != manifest["sha256"]:
             return False
 
-        return True
+        return self.validate_file(self.filename)
 
     @classmethod
     def validate_file(cls, filename):
         # check if file is valid
         try:
-            with open(filename, "r") as f:
-                json.load(f)
+            for _ in cls(filename=filename).read():
+                pass
         except FileNotFoundError:
             return False
-        except json.decoder.JSONDecodeError:
+        except (EOFError, OSError, ValueError):
+            # broken gzip or JSON
             return False
 
         return True
 
+    def read(self):
+        # blocking, run it in a thread
+        if self.is_legacy:
+            with open(self.filename, "r") as f:
+                for row in json.load(f):
+                    yield "feed", row
+        else:
+            with gzip.open(self.filename, "rb") as f:
+                for line in f:
+                    each = json.loads(line)
+                    yield each["table"], each["row"]
+
     #############
     # BACKUP DUMP
     #############
 
     @staticmethod
-    async def get_data(session: AsyncSession):
-        query = select(Feed)
-        feeds = await SQLAlchemy.execute_all(
-            query=query,
-            session=session,
+    def write_rows(file, table: str, rows: list[dict]):
+        # blocking, run it in a thread
+        file.write(
+            b"".join(
+                CompactJsonResponse.dumps({"table": table, "row": row}) + b"\n"
+                for row in rows
+            )
         )
-        return [feed.as_dict() for feed in feeds]
 
     @classmethod
-    async def dump(cls, session: AsyncSession):
-        data = await cls.get_data(session)
-        filename = cls.today()
+    async def dump_table(cls, file, table: str, query, session: AsyncSession) -> int:
+        # server-side cursor, so the table is never fully loaded in memory
+        count = 0
+        result = await session.stream(
+            query.execution_options(yield_per=cls.BATCH_SIZE),
+        )
+        try:
+            async for rows in result.mappings().partitions():
+                rows = [dict(row) for row in rows]
+                await asyncio.to_thread(cls.write_rows, file, table, rows)
+                count += len(rows)
+        finally:
+            await result.close()
 
-        with open(filename, "w") as f:
-            json.dump(data, f, indent=4)
+        return count
+
+    @classmethod
+    async def dump(cls, session: AsyncSession, incremental: bool = False):
+        async with cls.lock:
+            return await cls.dump_locked(session=session, incremental=incremental)
+
+    @classmethod
+    async def dump_locked(cls, session: AsyncSession, incremental: bool):
+        # DB time is used, as dt_created of updates is set by DB
+        started = await session.scalar(select(func.localtimestamp()))
+
+        since = None
+        previous = max(await asyncio.to_thread(cls.list), default=None)
+        if incremental and previous is not None:
+            since = previous.created - cls.INCREMENTAL_OVERLAP
+            filename_format = cls.FILENAME_FORMAT_INCREMENTAL
+        else:
+            filename_format = cls.FILENAME_FORMAT_FULL
+        filename = f"{ cls.BACKUP_LOCATION }/{ started.strftime(filename_format) }"
 
-        return cls(
+        # feed table is small, so it is always included in full
+        query_feeds = select(Feed.__table__).order_by(Feed._id)
+        query_updates = select(Update.__table__).order_by(Update.id)
+        if since is not None:
+            query_updates = query_updates.where(Update.dt_created >= since)
+
+        # written to temporary file first, so broken backups are never listed
+        rows = {}
+        file = await asyncio.to_thread(gzip.open, f"{filename}.tmp", "wb")
+        try:
+            rows["feed"] = await cls.dump_table(file, "feed", query_feeds, session)
+            rows["update"] = await cls.dump_table(
+                file, "update", query_updates, session
+            )
+        finally:
+            await asyncio.to_thread(file.close)
+        await asyncio.to_thread(os.replace, f"{filename}.tmp", filename)
+
+        backup = cls(
             filename=filename,
         )
+        backup.manifest = await asyncio.to_thread(backup.make_manifest, rows, since)
+        await asyncio.to_thread(backup.save_manifest)
+
+        return backup
 
     ################
     # BACKUP RESTORE
@@ -86,13 +315,19 @@ class Backup:
 
     @classmethod
     def list(cls):
+        # only index is read, use validate() to check files themselves
+        index = cls.read_index()
+        if index is None:
+            index = cls.reindex()
+
         items = []
-        for filename in os.listdir(path=cls.BACKUP_LOCATION):
-            filename = f"{ cls.BACKUP_LOCATION }/{ filename }"
-            if cls.validate_name(filename) and cls.validate_file(filename):
+        for file, manifest in index.items():
+            filename = f"{ cls.BACKUP_LOCATION }/{ file }"
+            if cls.validate_name(filename):
                 items.append(
                     cls(
                         filename=filename,
+                        manifest=manifest,
                     )
                 )
 
@@ -100,30 +335,285 @@ class Backup:
 
         return items
 
-    async def restore(self, session: AsyncSession, compare=True):
-        with open(self.filename) as f:
-            json_data = json.load(f)
-            if compare:
-                if self.get_data() == json_data:
-                    return "Backup data equals current DB data"
+    def read_batches(self, size: int):
+        # blocking, run it in a thread
+        # yields (table, rows) with up to `size` rows of the same table
+        batch_table, batch = None, []
+        for table, row in self.read():
+            if table != batch_table or len(batch) >= size:
+                if batch:
+                    yield batch_table, batch
+                batch_table, batch = table, []
+            batch.append(self.coerce_row(table, row))
+        if batch:
+            yield batch_table, batch
+
+    @classmethod
+    def coerce_row(cls, table: str, row: dict) -> dict:
+        # JSON keeps datetimes & enums as strings, DB driver needs objects
+        result = {}
+        for each in cls.TABLES[table].columns:
+            if each.name not in row:
+                continue
+            value = row[each.name]
+            if isinstance(value, str):
+                if isinstance(each.type, DateTime):
+                    # legacy backups have str(datetime), "None" included
+                    value = None if value == "None" else datetime.fromisoformat(value)
+                elif isinstance(each.type, Enum) and each.type.enum_class:
+                    value = each.type.enum_class(value)
+            result[each.name] = value
+
+        return result
+
+    @classmethod
+    def row_hash(cls, table: str, row: dict) -> bytes:
+        ignore = cls.COMPARE_IGNORE.get(table, ())
+        canonical = {key: value for key, value in row.items() if key not in ignore}
+        return hashlib.blake2b(
+            CompactJsonResponse.dumps(canonical),
+            digest_size=8,
+        ).digest()
+
+    @classmethod
+    def hash_rows(cls, table: str, rows: List[dict]) -> List[tuple]:
+        # blocking, run it in a thread
+        key = cls.TABLES[table].primary_key.columns[0].name
+        return [(row[key], cls.row_hash(table, row)) for row in rows]
+
+    def hash_file(self, table: str):
+        # blocking, run it in a thread
+        # yields lists of (primary key, hash) of one table in primary key order
+        batches = self.read_batches(self.BATCH_SIZE)
+        if self.is_legacy:
+            # legacy backups are one JSON list, it is in memory anyway
+            rows = [row for name, batch in batches if name == table for row in batch]
+            yield sorted(self.hash_rows(table, rows))
+            return
+
+        found, last = False, None
+        with closing(batches):
+            for name, rows in batches:
+                if name != table:
+                    if found:
+                        # tables are written one after another
+                        break
+                    continue
+                found = True
+                hashes = self.hash_rows(table, rows)
+                if last is not None and hashes[0][0] <= last:
+                    raise ValueError(f"{self} {table} is not ordered by primary key")
+                last = hashes[-1][0]
+                yield hashes
+
+    async def hash_file_batches(self, table: str):
+        batches = self.hash_file(table)
+        try:
+            while batch := await asyncio.to_thread(next, batches, None):
+                yield batch
+        finally:
+            await asyncio.to_thread(batches.close)
+
+    async def hash_db_batches(self, table: str, session: AsyncSession):
+        # yields lists of (primary key, hash) in primary key order
+        since = (self.manifest or {}).get("since")
+        query = select(self.TABLES[table])
+        query = query.order_by(*self.TABLES[table].primary_key.columns)
+        if table == "update" and since is not None:
+            # incremental backup only covers part of updates
+            query = query.where(Update.dt_created >= datetime.fromisoformat(since))
+
+        result = await session.stream(
+            query.execution_options(yield_per=self.BATCH_SIZE),
+        )
+        try:
+            async for rows in result.mappings().partitions():
+                rows = [self.coerce_row(table, dict(row)) for row in rows]
+                yield await asyncio.to_thread(self.hash_rows, table, rows)
+        finally:
+            await result.close()
+
+    @staticmethod
+    async def flatten(batches):
+        async for batch in batches:
+            for each in batch:
+                yield each
+
+    async def compare_table(self, table: str, session: AsyncSession) -> dict:
+        # both sides are streamed in primary key order and merged,
+        # so neither of them is held in memory
+        counts = Counter({"added": 0, "removed": 0, "changed": 0})
+        ids = {name: [] for name in counts}
+
+        def found(name: str, key):
+            counts[name] += 1
+            if len(ids[name]) < self.COMPARE_IDS_LIMIT:
+                ids[name].append(key)
+
+        async with (
+            aclosing(self.flatten(self.hash_file_batches(table))) as file_rows,
+            aclosing(self.flatten(self.hash_db_batches(table, session))) as db_rows,
+        ):
+            file_row = await anext(file_rows, None)
+            db_row = await anext(db_rows, None)
+            while file_row is not None or db_row is not None:
+                if db_row is None or (file_row is not None and file_row[0] < db_row[0]):
+                    found("removed", file_row[0])
+                    file_row = await anext(file_rows, None)
+                elif file_row is None or db_row[0] < file_row[0]:
+                    found("added", db_row[0])
+                    db_row = await anext(db_rows, None)
+                else:
+                    if file_row[1] != db_row[1]:
+                        found("changed", file_row[0])
+                    file_row = await anext(file_rows, None)
+                    db_row = await anext(db_rows, None)
+
+        return {
+            "equal": not any(counts.values()),
+            **counts,
+            "ids": ids,
+        }
+
+    async def compare(self, session: AsyncSession) -> dict:
+        # per-row hashes instead of comparing whole tables,
+        # added/removed are relative to backup: added are only in DB
+        if self.manifest is not None:
+            tables = self.manifest["tables"]
+        elif self.is_legacy:
+            # legacy backups contain feeds only
+            tables = ["feed"]
+        else:
+            tables = list(self.TABLES)
+
+        return {
+            table: await self.compare_table(table=table, session=session)
+            for table in self.TABLES
+            if table in tables
+        }
+
+    async def check_unique(self, session: AsyncSession, table: str, rows: List[dict]):
+        # upsert resolves conflicts of primary key only, rows that would
+        # violate other unique constraints are found here instead
+        # yields (primary key, reason) of such rows
+        table = self.TABLES[table]
+        key = table.primary_key.columns[0]
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint):
+                continue
+            columns = list(constraint.columns)
+            names = ", ".join(x.name for x in columns)
+
+            # NULLs never conflict
+            keys = {tuple(row.get(x.name) for x in columns) for row in rows}
+            keys = [x for x in keys if None not in x]
+            if not keys:
+                continue
+            # joined with VALUES, so unique index is used for every row
+            candidate = values(
+                *[column(x.name, x.type) for x in columns],
+                name="candidate",
+            ).data(keys)
+            query = select(key, *columns)
+            query = query.join(
+                candidate,
+                and_(*[x == candidate.c[x.name] for x in columns]),
+            )
+            owners = {tuple(x[1:]): x[0] for x in await session.execute(query)}
+
+            seen = {}
+            for row in rows:
+                value = tuple(row.get(x.name) for x in columns)
+                if None in value:
+                    continue
+                owner = owners.get(value, seen.get(value))
+                if owner is not None and owner != row[key.name]:
+                    yield row[key.name], f"({names}) already used by {key.name}={owner}"
+                else:
+                    seen.setdefault(value, row[key.name])
+
+    async def restore_rows(
+        self,
+        session: AsyncSession,
+        table: str,
+        rows: List[dict],
+    ) -> List[tuple]:
+        # returns (primary key, reason) of skipped rows
+        table_name, table = table, self.TABLES[table]
+        key = table.primary_key.columns[0].name
+        skipped = []
+        valid = []
+        for row in rows:
+            missing = []
+            for each in table.columns:
+                if row.get(each.name) is not None or each.nullable:
+                    continue
+                if isinstance(each.type, DateTime):
+                    # legacy backups have no value for some datetimes
+                    row[each.name] = self.created
                 else:
-                    return "Data is different"
+                    missing.append(each.name)
+            if missing:
+                skipped.append((row.get(key), f"no value of {', '.join(missing)}"))
             else:
-                for each in json_data:
-                    feed = Feed(
-                        title=each["title"],
-                        href=each["href"],
-                        href_user=each["href_user"],
-                        private=each["private"],
-                        frequency=each["frequency"],
-                        notes=each["notes"],
-                        json=each["json"],
-                        _id=each["_id"],
-                        _created=each["_created"],
-                        _delayed=None,
-                    )
-                    session.add(feed)
+                valid.append(row)
+
+        conflicts = dict(
+            [x async for x in self.check_unique(session, table_name, valid)]
+        )
+        skipped.extend(conflicts.items())
+        valid = [row for row in valid if row[key] not in conflicts]
+        if not valid:
+            return skipped
+
+        query = insert(table)
+        query = query.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={
+                each.name: query.excluded[each.name]
+                for each in table.columns
+                if not each.primary_key
+            },
+        )
+        await session.execute(query, valid)
+
+        return skipped
 
-                # await session.commit()
+    async def restore(self, session: AsyncSession, compare=True):
+        if compare:
+            return await self.compare(session=session)
+
+        # upsert in batches, feeds are stored before updates in backup files
+        restored = Counter()
+        skipped = defaultdict(lambda: {"count": 0, "rows": []})
+        batches = self.read_batches(self.BATCH_SIZE)
+        while batch := await asyncio.to_thread(next, batches, None):
+            table, rows = batch
+            skipped_rows = await self.restore_rows(
+                session=session, table=table, rows=rows
+            )
+            restored[table] += len(rows) - len(skipped_rows)
+            skipped[table]["count"] += len(skipped_rows)
+            for row_id, reason in skipped_rows:
+                if len(skipped[table]["rows"]) < self.COMPARE_IDS_LIMIT:
+                    skipped[table]["rows"].append({"id": row_id, "reason": reason})
+
+        # rows are restored with their ids, so sequences are moved past them
+        for table in self.TABLES.values():
+            key = table.primary_key.columns[0]
+            await session.execute(
+                select(
+                    func.setval(
+                        func.pg_get_serial_sequence(
+                            f"{table.schema}.{table.name}", key.name
+                        ),
+                        select(func.coalesce(func.max(key), 0) + 1).scalar_subquery(),
+                        False,
+                    )
+                )
+            )
 
-                return "Restoration complete"
+        return {
+            "restored": dict(restored),
+            "skipped": dict(skipped),
+        }
@@ -1,40 +1,142 @@
+import json
 import logging
-from datetime import datetime, timedelta
+from datetime import timedelta
 from os import getenv
 
 import redis.asyncio as redis
 
+from config.settings import settings
+
 
 logger = logging.getLogger(__name__)
 
 
-class Cache:
+# codecs convert values to bytes stored in redis and back
+class JsonCodec:
+    @staticmethod
+    def encode(value) -> bytes:
+        return json.dumps(
+            value,
+            ensure_ascii=False,
+            separators=(",", ":"),
+            default=str,
+        ).encode("utf-8")
+
+    @staticmethod
+    def decode(value: bytes):
+        return json.loads(value)
+
+
+class StrCodec:
+    @staticmethod
+    def encode(value) -> bytes:
+        return str(value).encode("utf-8")
+
+    @staticmethod
+    def decode(value: bytes) -> str:
+        return value.decode("utf-8")
+
+
+class BytesCodec:
     @staticmethod
-    def key_from_href() -> str:
-        return "swamp-api:auth:admin-access-token"
+    def encode(value: bytes) -> bytes:
+        return value
+
+    @staticmethod
+    def decode(value: bytes) -> bytes:
+        return value
+
+
+class Cache:
+    PREFIX = "swamp-api"
+    # one client (and connection pool) shared by the whole process
+    _client: redis.Redis = None
+
+    @classmethod
+    def client(cls) -> redis.Redis:
+        if cls._client is None:
+            cls._client = redis.Redis(
+                connection_pool=redis.ConnectionPool.from_url(
+                    getenv("REDIS"),
+                    max_connections=settings.REDIS_MAX_CONNECTIONS,
+                ),
+            )
+
+        return cls._client
+
+    @classmethod
+    async def open(cls):
+        try:
+            await cls.client().ping()
+        except redis.RedisError as e:
+            # not fatal, connections are retried on every call
+            logger.warning(f"Redis is not available on startup: {e}")
+
+    @classmethod
+    async def close(cls):
+        if cls._client is not None:
+            await cls._client.aclose(close_connection_pool=True)
+            cls._client = None
+
+    @classmethod
+    def key(cls, namespace: str, *parts) -> str:
+        return ":".join([cls.PREFIX, namespace, *map(str, parts)])
 
     @staticmethod
-    def timeout(timeout: dict) -> datetime:
-        return datetime.now() + timedelta(**timeout)
-
-    @classmethod
-    async def get(cls) -> str:
-        r = await redis.from_url(getenv("REDIS"), decode_responses=True)
-        async with r.pipeline(transaction=True) as pipe:
-            values = await pipe.get(cls.key_from_href()).execute()
-            # result is a list, but we need only one item
-            # if values[0] is not None:
-            #     logger.debug(f"Successful cache retrieval for {href=}")
-            return values[0]
-
-    @classmethod
-    async def set(cls, value: str, timeout: dict):
-        r = await redis.from_url(getenv("REDIS"), decode_responses=True)
-        async with r.pipeline(transaction=True) as pipe:
-            await pipe.set(
-                cls.key_from_href(),
-                str(value),
-            ).expireat(
-                cls.key_from_href(),
-                cls.timeout(timeout=timeout),
-            ).execute()
+    def ttl(ttl: int | timedelta | None) -> int | None:
+        if isinstance(ttl, timedelta):
+            return int(ttl.total_seconds())
+        return ttl
+
+    @classmethod
+    async def get(cls, key: str, codec=JsonCodec, default=None):
+        value = await cls.client().get(key)
+        if value is None:
+            return default
+
+        return codec.decode(value)
+
+    @classmethod
+    async def set(
+        cls,
+        key: str,
+        value,
+        ttl: int | timedelta | None = None,
+        codec=JsonCodec,
+    ):
+        await cls.client().set(key, codec.encode(value), ex=cls.ttl(ttl))
+
+    @classmethod
+    async def get_many(cls, keys: list[str], codec=JsonCodec) -> dict:
+        if not keys:
+            return {}
+
+        values = await cls.client().mget(keys)
+        # missing keys are not returned
+        return {
+            key: codec.decode(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+    @classmethod
+    async def set_many(
+        cls,
+        items: dict,
+        ttl: int | timedelta | None = None,
+        codec=JsonCodec,
+    ):
+        if not items:
+            return
+
+        async with cls.client().pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, codec.encode(value), ex=cls.ttl(ttl))
+            await pipe.execute()
+
+    @classmethod
+    async def delete(cls, *keys: str) -> int:
+        if not keys:
+            return 0
+
+        return await cls.client().delete(*keys)
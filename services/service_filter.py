@@ -0,0 +1,61 @@
+import json
+import re
+from functools import lru_cache
+
+
+# filter is used to remove unnecessary items
+# {field}        - don't skip what's mentioned there
+# {field}_ignore - skip these ones
+# in case of future review:
+# SELECT _id, title, json FROM feed_updates.feed WHERE json ? 'filter'
+class FeedFilter:
+    SUPPORTED_FIELDS = ("name", "href")
+
+    def __init__(self, keep: dict[str, tuple], ignore: dict[str, re.Pattern]):
+        # all values have to be present
+        self.keep = keep
+        # any value has to be absent, checked with a single regex
+        self.ignore = ignore
+
+    def __call__(self, update) -> bool:
+        for field, values in self.keep.items():
+            field_value = getattr(update, field)
+            for each_value in values:
+                if each_value not in field_value:
+                    return False
+
+        for field, pattern in self.ignore.items():
+            if pattern.search(getattr(update, field)):
+                return False
+
+        return True
+
+    @classmethod
+    def from_json(cls, feed_json: dict) -> "FeedFilter":
+        # compiled filters are cached by their content,
+        # so changing feed's json produces a new one
+        filters = (feed_json or {}).get("filter", {})
+        return cls.compile(json.dumps(filters, sort_keys=True))
+
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def compile(cls, filters: str) -> "FeedFilter":
+        keep = {}
+        ignore = {}
+
+        for filter_name, filter_value in json.loads(filters).items():
+            if isinstance(filter_value, str):
+                filter_value = [filter_value]
+
+            if not isinstance(filter_value, list):
+                raise TypeError("Filter value is expected to be STR or LIST")
+
+            if "_ignore" not in filter_name:
+                if filter_name in cls.SUPPORTED_FIELDS:
+                    keep[filter_name] = tuple(filter_value)
+            else:
+                field = filter_name.replace("_ignore", "")
+                if field in cls.SUPPORTED_FIELDS and filter_value:
+                    ignore[field] = re.compile("|".join(map(re.escape, filter_value)))
+
+        return cls(keep=keep, ignore=ignore)
@@ -18,44 +18,67 @@ class Frequency(Enum):
     def list(cls):
         return list(map(lambda c: c.value, cls))
 
-    def delay(self):
+    def ranges(self) -> dict:
+        # timedelta arguments, each one is random between the two values
         if self == self.MINUTES:
-            return timedelta(
-                minutes=random.randint(3, 60),
-            )
+            return {
+                "minutes": (3, 60),
+            }
         elif self == self.HOURS:
-            return timedelta(
-                minutes=random.randint(-15, 15),
-                hours=random.randint(3, 12),
-            )
+            return {
+                "minutes": (-15, 15),
+                "hours": (3, 12),
+            }
         elif self == self.DAYS:
-            return timedelta(
-                minutes=random.randint(-15, 15),
-                hours=random.randint(-6, 6),
-                days=random.randint(2, 7),
-            )
+            return {
+                "minutes": (-15, 15),
+                "hours": (-6, 6),
+                "days": (2, 7),
+            }
         elif self == self.WEEKS:
-            return timedelta(
-                minutes=random.randint(-15, 15),
-                hours=random.randint(-6, 6),
-                days=random.randint(-7, 7),
-                weeks=random.randint(2, 6),
-            )
+            return {
+                "minutes": (-15, 15),
+                "hours": (-6, 6),
+                "days": (-7, 7),
+                "weeks": (2, 6),
+            }
         elif self == self.MONTHS:
-            return timedelta(
-                minutes=random.randint(-15, 15),
-                hours=random.randint(-6, 6),
-                days=random.randint(-7, 7),
-                weeks=random.randint(6, 37),
-            )
+            return {
+                "minutes": (-15, 15),
+                "hours": (-6, 6),
+                "days": (-7, 7),
+                "weeks": (6, 37),
+            }
         elif self == self.YEARS:
-            return timedelta(
-                minutes=random.randint(-15, 15),
-                hours=random.randint(-6, 6),
-                days=random.randint(-7, 7),
-                weeks=random.randint(42, 150),
-            )
+            return {
+                "minutes": (-15, 15),
+                "hours": (-6, 6),
+                "days": (-7, 7),
+                "weeks": (42, 150),
+            }
         elif self == self.NEVER:
-            return timedelta(0)
+            return {}
         else:
             raise Exception(f"It's not expected to happen, frequency={self}")
+
+    def delay(self) -> timedelta:
+        return timedelta(
+            **{
+                key: random.randint(low, high)
+                for key, (low, high) in self.ranges().items()
+            }
+        )
+
+    def bounds(self) -> tuple[timedelta, timedelta]:
+        # shortest and longest delay() can return
+        ranges = self.ranges()
+
+        return (
+            timedelta(**{key: low for key, (low, _) in ranges.items()}),
+            timedelta(**{key: high for key, (_, high) in ranges.items()}),
+        )
+
+    def clamp(self, delay: timedelta) -> timedelta:
+        low, high = self.bounds()
+
+        return min(max(delay, low), high)
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import redis.asyncio as redis
+from sqlalchemy import select
+
+from config.settings import settings
+from models.model_feeds import Feed
+from services.service_cache import Cache
+from services.service_refresh import Refresh
+from services.service_response_cache import ResponseCache
+from services.service_sqlalchemy import SQLAlchemy
+
+
+logger = logging.getLogger(__name__)
+
+
+# bulk import of feeds from list of hrefs, done in background
+# outcome of each href:
+#   invalid   => not http(s) link
+#   duplicate => same normalized href was already submitted in this job
+#   exists    => feed with same normalized href is already in DB
+#   new       => feed is created, with similar_feeds for information,
+#                see Feed.find_similar
+#   failed    => parsing or saving failed, see description (and similar_feeds)
+class ImportJob:
+    # state is kept in cache only, jobs are not needed for long
+    TTL = timedelta(days=1)
+    # running jobs, references are kept so tasks are not garbage collected
+    tasks: set[asyncio.Task] = set()
+
+    def __init__(self, hrefs: list[str], job_id: str = None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.status = "pending"
+        self.created = datetime.now().isoformat()
+        self.finished = None
+        self.description = None
+        # results are keyed by href, so repeated ones are submitted once
+        self.hrefs = list(dict.fromkeys(x.strip() for x in hrefs))
+        self.results = {}
+        # pacing of parser requests to each host
+        self.host_locks = defaultdict(asyncio.Lock)
+        self.host_last = defaultdict(float)
+        self.last_saved = 0.0
+
+    @staticmethod
+    def key(job_id: str) -> str:
+        return Cache.key("import", job_id)
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "description": self.description,
+            "total": len(self.hrefs),
+            "done": len(self.results),
+            "counts": dict(Counter(x["status"] for x in self.results.values())),
+            "results": self.results,
+        }
+
+    async def save(self, force: bool = True):
+        # progress is saved at most once a second, final state always
+        if not force and time.monotonic() - self.last_saved < 1:
+            return
+        self.last_saved = time.monotonic()
+
+        try:
+            await Cache.set(self.key(self.job_id), self.as_dict(), ttl=self.TTL)
+        except redis.RedisError as e:
+            logger.warning(f"Import job {self.job_id} state was not saved: {e}")
+
+    @classmethod
+    async def get(cls, job_id: str) -> dict | None:
+        return await Cache.get(cls.key(job_id))
+
+    @classmethod
+    async def submit(cls, hrefs: list[str]) -> dict:
+        job = cls(hrefs=hrefs)
+        await job.save()
+
+        task = asyncio.create_task(job.run())
+        cls.tasks.add(task)
+        task.add_done_callback(cls.tasks.discard)
+
+        return job.as_dict()
+
+    @classmethod
+    async def close(cls):
+        for task in cls.tasks:
+            task.cancel()
+        await asyncio.gather(*cls.tasks, return_exceptions=True)
+
+    def result(self, href: str, status: str, **kwargs):
+        self.results[href] = {"status": status, **kwargs}
+
+    async def pace(self, href: str):
+        # parser requests to the same host are started with intervals
+        host = Refresh.host(href)
+        async with self.host_locks[host]:
+            delay = (
+                self.host_last[host] + settings.IMPORT_HOST_INTERVAL - time.monotonic()
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.host_last[host] = time.monotonic()
+
+    async def parse(self, href: str, limit: asyncio.Semaphore) -> Feed | None:
+        await self.pace(href)
+        async with limit:
+            try:
+                return await Feed.parse_href(href)
+            except Exception as e:
+                self.result(href, "failed", description=str(e))
+                await self.save(force=False)
+
+    async def run_batch(self, hrefs: dict, limit: asyncio.Semaphore):
+        # hrefs: {normalized href: href}
+        href_normalized = Feed.normalize_href_sql(Feed.href)
+        query = select(Feed._id, href_normalized)
+        query = query.where(href_normalized.in_(list(hrefs)))
+        async with SQLAlchemy.async_session() as session:
+            for feed_id, normalized in await session.execute(query):
+                if normalized in hrefs:
+                    self.result(hrefs.pop(normalized), "exists", feed_id=feed_id)
+
+        # DB connection is not held while parsing
+        hrefs = list(hrefs.values())
+        feeds = await asyncio.gather(*[self.parse(href, limit) for href in hrefs])
+        parsed = [(href, feed) for href, feed in zip(hrefs, feeds) if feed is not None]
+        if not parsed:
+            return
+
+        async with SQLAlchemy.session_scope() as session:
+            similar = await Feed.find_similar([x for _, x in parsed], session=session)
+            for (href, feed), similar_feeds in zip(parsed, similar):
+                # parsed href can differ from submitted one
+                duplicate = next(
+                    (x for x, _ in similar_feeds if feed.is_duplicate(x)), None
+                )
+                if duplicate is not None:
+                    self.result(href, "exists", feed_id=duplicate._id)
+                    continue
+                # only for information, e.g. same title blocks creation
+                similar_feeds = [
+                    {"_id": x._id, "similarity": similarity}
+                    for x, similarity in similar_feeds
+                ]
+
+                try:
+                    # feeds of the same batch can still collide with each other
+                    async with session.begin_nested():
+                        session.add(feed)
+                        await session.flush()
+                except Exception as e:
+                    self.result(
+                        href,
+                        "failed",
+                        description=str(e),
+                        similar_feeds=similar_feeds,
+                    )
+                else:
+                    self.result(
+                        href,
+                        "new",
+                        feed_id=feed._id,
+                        similar_feeds=similar_feeds,
+                    )
+        await ResponseCache.invalidate()
+
+    async def run(self):
+        self.status = "running"
+        await self.save()
+
+        try:
+            seen = {}
+            batch = {}
+            limit = asyncio.Semaphore(settings.IMPORT_CONCURRENCY)
+            for href in self.hrefs:
+                normalized = Feed.normalize_href(href)
+                if not href.startswith(("https://", "http://")):
+                    self.result(href, "invalid")
+                elif normalized in seen:
+                    self.result(href, "duplicate", duplicate_of=seen[normalized])
+                else:
+                    seen[normalized] = href
+                    batch[normalized] = href
+
+                if len(batch) >= settings.IMPORT_BATCH:
+                    await self.run_batch(batch, limit)
+                    await self.save(force=False)
+                    batch = {}
+            if batch:
+                await self.run_batch(batch, limit)
+
+            self.status = "finished"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception(f"Import job {self.job_id} failed")
+            self.status = "failed"
+            self.description = str(e)
+        finally:
+            self.finished = datetime.now().isoformat()
+            await self.save()
@@ -0,0 +1,105 @@
+import functools
+import logging
+import os
+import socket
+import uuid
+
+import redis.asyncio as redis
+
+from config.settings import settings
+from services.service_cache import Cache
+
+
+logger = logging.getLogger(__name__)
+
+
+# one process (of all workers and pods) is a leader at a time,
+# jobs that should run only once are decorated with Leader.only;
+# leadership is a Redis key with TTL, renewed by heartbeat() of the leader
+class Leader:
+    # both are done only by the owner of the key
+    SCRIPT_RENEW = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("pexpire", KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    SCRIPT_RELEASE = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("del", KEYS[1])
+        end
+        return 0
+    """
+    is_leader = False
+    # set by open() of every process, not on import:
+    # workers forked after import would share it and all be leaders
+    instance: str = None
+
+    @staticmethod
+    def key() -> str:
+        return Cache.key("leader")
+
+    @classmethod
+    async def open(cls):
+        # on startup, leader is known before first scheduled job
+        cls.instance = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        cls.is_leader = False
+        await cls.heartbeat()
+
+    @classmethod
+    async def heartbeat(cls) -> bool:
+        if not settings.LEADER_ELECTION:
+            # every process runs everything
+            cls.is_leader = True
+            return cls.is_leader
+        if cls.instance is None:
+            logger.warning("Leader.open() was not called, not a leader")
+            return cls.is_leader
+
+        ttl = int(settings.LEADER_TTL * 1000)
+        was_leader = cls.is_leader
+        try:
+            client = Cache.client()
+            if cls.is_leader:
+                renewed = await client.eval(
+                    cls.SCRIPT_RENEW, 1, cls.key(), cls.instance, ttl
+                )
+                cls.is_leader = bool(renewed)
+            if not cls.is_leader:
+                acquired = await client.set(cls.key(), cls.instance, nx=True, px=ttl)
+                cls.is_leader = bool(acquired)
+        except redis.RedisError as e:
+            # without Redis nobody can be sure it is the only leader
+            logger.warning(f"Leader election failed: {e}")
+            cls.is_leader = False
+
+        if cls.is_leader != was_leader:
+            state = "became" if cls.is_leader else "is no longer"
+            logger.warning(f"Instance {cls.instance} {state} the leader")
+
+        return cls.is_leader
+
+    @classmethod
+    async def release(cls):
+        # on shutdown, so another instance takes over on its next heartbeat
+        if not settings.LEADER_ELECTION or not cls.is_leader:
+            return
+
+        cls.is_leader = False
+        try:
+            await Cache.client().eval(cls.SCRIPT_RELEASE, 1, cls.key(), cls.instance)
+        except redis.RedisError as e:
+            logger.warning(f"Leadership was not released: {e}")
+
+    @classmethod
+    def only(cls, func):
+        # decorated job is skipped by every instance except the leader
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not cls.is_leader:
+                logger.debug(f"Skipping {func.__name__}, not the leader")
+                return None
+
+            return await func(*args, **kwargs)
+
+        return wrapper
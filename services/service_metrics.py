@@ -0,0 +1,97 @@
+import time
+from contextlib import contextmanager
+
+from fastapi import Request
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.routing import Match
+
+
+# Prometheus metrics of this process, exposed at /metrics
+class Metrics:
+    HTTP_DURATION = Histogram(
+        "swamp_http_request_duration_seconds",
+        "HTTP request latency by route template",
+        ["method", "route", "status"],
+    )
+    HTTP_IN_FLIGHT = Gauge(
+        "swamp_http_requests_in_flight",
+        "HTTP requests being processed",
+        ["method", "route"],
+    )
+    DB_POOL = Gauge(
+        "swamp_db_pool_connections",
+        "DB pool connections by state, updated on scrape",
+        ["engine", "state"],
+    )
+    PARSER_DURATION = Histogram(
+        "swamp_parser_request_duration_seconds",
+        "swamp-parser call latency",
+        ["path", "outcome"],
+        buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    )
+    PARSER_ERRORS = Counter(
+        "swamp_parser_errors_total",
+        "failed swamp-parser calls by exception",
+        ["path", "error"],
+    )
+    INGEST_RECEIVED = Counter(
+        "swamp_ingest_received_updates_total",
+        "updates passed to Feed.ingest_updates",
+    )
+    INGEST_INGESTED = Counter(
+        "swamp_ingest_ingested_updates_total",
+        "new updates stored by Feed.ingest_updates",
+    )
+    TELEGRAM_DURATION = Histogram(
+        "swamp_telegram_send_duration_seconds",
+        "Telegram sendMessage latency, without throttling",
+        ["outcome"],
+    )
+
+    @staticmethod
+    def route(request: Request) -> str:
+        # route template, so paths with ids do not create new series
+        for route in request.app.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                return route.path
+
+        return "unmatched"
+
+    @classmethod
+    async def middleware(cls, request: Request, call_next):
+        method, route = request.method, cls.route(request)
+        status = 500
+        started = time.perf_counter()
+        cls.HTTP_IN_FLIGHT.labels(method, route).inc()
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            cls.HTTP_IN_FLIGHT.labels(method, route).dec()
+            cls.HTTP_DURATION.labels(method, route, status).observe(
+                time.perf_counter() - started
+            )
+
+    @staticmethod
+    @contextmanager
+    def timer(histogram: Histogram, **labels):
+        # labels are completed with outcome: success or error
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            histogram.labels(outcome="error", **labels).observe(
+                time.perf_counter() - started
+            )
+            raise
+        histogram.labels(outcome="success", **labels).observe(
+            time.perf_counter() - started
+        )
+
+    @classmethod
+    def update_pool(cls, pool_stats: dict):
+        for engine, stats in pool_stats.items():
+            for state, value in stats.items():
+                cls.DB_POOL.labels(engine, state).set(value)
@@ -0,0 +1,54 @@
+import json
+import zlib
+from collections.abc import AsyncIterator
+
+from fastapi import Request
+
+
+class Ndjson:
+    @staticmethod
+    async def read(request: Request) -> AsyncIterator[tuple[int, dict]]:
+        # parses request body line by line while it is still being received,
+        # gzip-compressed bodies are supported via Content-Encoding
+        decompressor = None
+        if request.headers.get("content-encoding", "").lower() == "gzip":
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+
+        line_number = 0
+        buffer = b""
+        async for chunk in request.stream():
+            if decompressor is not None:
+                chunk = Ndjson.decompress(decompressor, chunk)
+            buffer += chunk
+
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield line_number, Ndjson.loads(line, line_number)
+
+        if decompressor is not None:
+            buffer += Ndjson.decompress(decompressor)
+            if not decompressor.eof:
+                raise ValueError("Gzip body is truncated")
+        for line in buffer.split(b"\n"):
+            line_number += 1
+            if line.strip():
+                yield line_number, Ndjson.loads(line, line_number)
+
+    @staticmethod
+    def decompress(decompressor, chunk: bytes = None) -> bytes:
+        # broken body is client error, like invalid JSON
+        try:
+            if chunk is None:
+                return decompressor.flush()
+            return decompressor.decompress(chunk)
+        except (EOFError, zlib.error) as e:
+            raise ValueError(f"Gzip body is not valid: {e}")
+
+    @staticmethod
+    def loads(line: bytes, line_number: int):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_number} is not valid JSON: {e}")
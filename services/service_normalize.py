@@ -0,0 +1,86 @@
+import asyncio
+import datetime as dt
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from zoneinfo import ZoneInfo
+
+import emoji
+
+from config.settings import settings
+
+
+# turns raw updates from swamp-parser into values stored in DB
+class Normalizer:
+    # hashtags and underscores become spaces in one pass
+    NAME_TRANSLATION = str.maketrans({"#": " ", "_": " "})
+    pool: ProcessPoolExecutor = None
+
+    @staticmethod
+    @cache
+    def timezone() -> ZoneInfo:
+        return ZoneInfo(settings.TIMEZONE_LOCAL)
+
+    @classmethod
+    def zone_fix(cls, datetime: dt.datetime) -> dt.datetime:
+        if datetime.tzinfo:
+            # if tzinfo present — convert to current one
+            return datetime.astimezone(cls.timezone())
+        else:
+            # if no tzinfo — replace it with current one
+            return datetime.replace(tzinfo=cls.timezone())
+
+    @classmethod
+    def name(cls, name: str) -> str:
+        # there are no emojis in ASCII, so demojize is skipped for it
+        if not name.isascii():
+            # transforming emojis to normal words
+            name = emoji.demojize(name, delimiters=(" ", " "))
+        name = name.translate(cls.NAME_TRANSLATION).strip()
+
+        return name[:300] or "No name in update"
+
+    @classmethod
+    def datetime(cls, datetime: str) -> dt.datetime:
+        if isinstance(datetime, str):
+            datetime = dt.datetime.fromisoformat(datetime)
+        else:
+            raise ValueError("Update.__init__() datetime is expected to be str")
+
+        return cls.zone_fix(datetime)
+
+    @classmethod
+    def batch(cls, items: list[dict]) -> list[tuple[str, dt.datetime, str]]:
+        return [
+            (cls.name(x["name"]), cls.datetime(x["datetime"]), x["href"][:300])
+            for x in items
+        ]
+
+    @classmethod
+    async def batch_async(cls, items: list[dict]) -> list[tuple]:
+        threshold = settings.NORMALIZE_PROCESS_THRESHOLD
+        if not threshold or len(items) < threshold:
+            return cls.batch(items)
+
+        # very large batches are split between worker processes
+        if cls.pool is None:
+            cls.pool = ProcessPoolExecutor(
+                max_workers=settings.NORMALIZE_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        loop = asyncio.get_running_loop()
+        size = settings.NORMALIZE_PROCESS_CHUNK
+        chunks = await asyncio.gather(
+            *[
+                loop.run_in_executor(cls.pool, cls.batch, items[i : i + size])
+                for i in range(0, len(items), size)
+            ]
+        )
+
+        return [x for chunk in chunks for x in chunk]
+
+    @classmethod
+    def close(cls):
+        if cls.pool is not None:
+            cls.pool.shutdown(cancel_futures=True)
+            cls.pool = None
@@ -0,0 +1,53 @@
+import aiohttp
+
+from config.settings import settings
+from services.service_metrics import Metrics
+
+
+# single long-lived client for all swamp-parser calls
+class SwampParser:
+    session: aiohttp.ClientSession = None
+
+    @classmethod
+    async def open(cls) -> aiohttp.ClientSession:
+        if cls.session is None or cls.session.closed:
+            cls.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=settings.SWAMP_PARSER_LIMIT,
+                    limit_per_host=settings.SWAMP_PARSER_LIMIT_PER_HOST,
+                    ttl_dns_cache=settings.SWAMP_PARSER_DNS_TTL,
+                    keepalive_timeout=settings.SWAMP_PARSER_KEEPALIVE,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=settings.SWAMP_PARSER_TIMEOUT,
+                    sock_connect=settings.SWAMP_PARSER_TIMEOUT_CONNECT,
+                ),
+                raise_for_status=True,
+            )
+
+        return cls.session
+
+    @classmethod
+    async def close(cls):
+        if cls.session is not None:
+            await cls.session.close()
+            cls.session = None
+
+    @classmethod
+    async def get_json(cls, path: str, href: str, timeout: float = None):
+        session = await cls.open()
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        try:
+            with Metrics.timer(Metrics.PARSER_DURATION, path=path):
+                async with session.get(
+                    f"{ settings.SWAMP_PARSER }{ path }",
+                    params={"href": href},
+                    **kwargs,
+                ) as response:
+                    return await response.json()
+        except Exception as e:
+            Metrics.PARSER_ERRORS.labels(path, type(e).__name__).inc()
+            raise
@@ -0,0 +1,105 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# SQL statements of current request: count, time & repeated ones,
+# reported as Server-Timing header; slow queries are logged everywhere
+class QueryStats:
+    current: ContextVar["QueryStats | None"] = ContextVar("query_stats", default=None)
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.statements = Counter()
+
+    @classmethod
+    def instrument(cls, engine: AsyncEngine):
+        event.listen(engine.sync_engine, "before_cursor_execute", cls.before_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", cls.after_execute)
+
+    @staticmethod
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        # kept on execution context, so failed statements leave nothing behind
+        if context is not None:
+            context.query_started = time.perf_counter()
+
+    @classmethod
+    def after_execute(cls, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "query_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+
+        stats = cls.current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db += duration
+            stats.statements[statement] += 1
+
+        if duration * 1000 >= settings.SQL_SLOW_QUERY_MS:
+            logger.warning(
+                f"Slow query, {duration * 1000:.1f} ms: {statement} "
+                f"parameters={str(parameters)[:1000]}"
+            )
+
+    @classmethod
+    @contextmanager
+    def serializing(cls):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = cls.current.get()
+            if stats is not None:
+                stats.serialize += time.perf_counter() - started
+
+    def server_timing(self, total: float) -> str:
+        return ", ".join(
+            [
+                f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+                f"serialize;dur={self.serialize * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+
+    def report(self, request: Request):
+        # same statement executed many times is usually N+1 query
+        for statement, count in self.statements.items():
+            if count >= settings.SQL_REPEATED_STATEMENTS:
+                logger.warning(
+                    f"Statement repeated {count} times in "
+                    f"{request.method} {request.url.path}: {statement}"
+                )
+
+    @classmethod
+    async def middleware(cls, request: Request, call_next):
+        if not settings.SQL_INSTRUMENTATION:
+            return await call_next(request)
+
+        stats = cls()
+        token = cls.current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            cls.current.reset(token)
+
+        response.headers["Server-Timing"] = stats.server_timing(
+            time.perf_counter() - started
+        )
+        stats.report(request)
+
+        return response
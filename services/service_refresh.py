@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from config.settings import settings
+from models.model_feeds import Feed
+from models.model_updates import Update
+from services.service_response_cache import ResponseCache
+from services.service_sqlalchemy import SQLAlchemy
+
+
+logger = logging.getLogger(__name__)
+
+
+# fetches updates for all due feeds and ingests them
+class Refresh:
+    # only one refresh run per process at a time
+    lock = asyncio.Lock()
+
+    @staticmethod
+    def host(href: str) -> str:
+        return urlparse(href).hostname or href
+
+    @staticmethod
+    async def claim_feeds() -> list:
+        # claimed feeds are not given to other processes or pods
+        async with SQLAlchemy.session_scope() as session:
+            feeds = await Feed.claim(
+                limit=settings.REFRESH_CLAIM_LIMIT,
+                lease=timedelta(minutes=settings.REFRESH_LEASE_MINUTES),
+                session=session,
+            )
+        await ResponseCache.invalidate()
+
+        return feeds
+
+    @staticmethod
+    async def refresh_feed(
+        feed_id: int,
+        href: str,
+        limit: asyncio.Semaphore,
+        limit_host: asyncio.Semaphore,
+        limit_db: asyncio.Semaphore,
+    ) -> int:
+        # host limit goes first, so busy hosts do not occupy global slots
+        async with limit_host, limit:
+            updates = await Update.parse_href(href, feed_id=feed_id)
+
+        # parser calls are done without holding a DB connection,
+        # sessions are limited separately, so the pool is not exhausted
+        async with limit_db, SQLAlchemy.session_scope() as session:
+            feed = await session.get(Feed, feed_id)
+            if feed is None:
+                # feed was deleted while we were fetching it
+                return 0
+
+            ingested = await feed.ingest_updates(updates, session)
+        await ResponseCache.invalidate()
+
+        return len(ingested)
+
+    @classmethod
+    async def run(cls) -> dict:
+        if cls.lock.locked():
+            logger.warning("Feed refresh is already running, skipping")
+            return {"success": False, "description": "Refresh is already running"}
+
+        async with cls.lock:
+            started = time.monotonic()
+            feeds = await cls.claim_feeds()
+
+            limit = asyncio.Semaphore(settings.REFRESH_CONCURRENCY)
+            limits_host = defaultdict(
+                lambda: asyncio.Semaphore(settings.REFRESH_CONCURRENCY_PER_HOST)
+            )
+            limit_db = asyncio.Semaphore(
+                min(settings.REFRESH_CONCURRENCY_DB, settings.DB_POOL_SIZE)
+            )
+            results = await asyncio.gather(
+                *[
+                    cls.refresh_feed(
+                        feed_id=feed_id,
+                        href=href,
+                        limit=limit,
+                        limit_host=limits_host[cls.host(href)],
+                        limit_db=limit_db,
+                    )
+                    for feed_id, href in feeds
+                ],
+                return_exceptions=True,
+            )
+
+            failed = 0
+            updates = 0
+            for (feed_id, href), result in zip(feeds, results):
+                if isinstance(result, Exception):
+                    failed += 1
+                    logger.warning(
+                        f"Feed refresh failed for {feed_id=} {href=}: {result}"
+                    )
+                else:
+                    updates += result
+
+            # avoiding division by zero on empty runs
+            seconds = max(time.monotonic() - started, 0.001)
+            stats = {
+                "success": True,
+                "feeds": len(feeds),
+                "failed": failed,
+                "updates": updates,
+                "seconds": round(seconds, 3),
+                "feeds_per_second": round(len(feeds) / seconds, 3),
+                "updates_per_second": round(updates / seconds, 3),
+            }
+            logger.info(f"Feed refresh finished: {stats}")
+
+            return stats
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from urllib.parse import urlencode
+
+import redis.asyncio as redis
+from fastapi import Request
+from starlette.responses import Response
+
+from config.settings import settings
+from responses.JsonResponse import JsonResponse
+from services.service_cache import BytesCodec, Cache
+
+
+logger = logging.getLogger(__name__)
+
+
+# read-through cache of GET responses that only change on writes:
+# every write increases generation, so older entries are never read again
+# and expire on their own after RESPONSE_CACHE_TTL
+class ResponseCache:
+    PATHS = [
+        re.compile(r"^/feeds/$"),
+        re.compile(r"^/feeds/\d+/$"),
+        re.compile(r"^/updates/$"),
+    ]
+    # query params that make response depend on time, not only on writes
+    # (requires_update compares _delayed with now), not cached unless false
+    PARAMS_SKIP = {"requires_update"}
+    FALSE = {"0", "false", "f", "no", "n", "off"}
+    # headers that are not stored, they are set for every response again
+    HEADERS_SKIP = {"content-length", "etag"}
+    # identical requests computed right now, others wait for their result
+    inflight: dict[str, asyncio.Future] = {}
+    # delayed invalidations, references are kept so they are not garbage collected
+    tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def generation_key() -> str:
+        return Cache.key("responses", "generation")
+
+    @classmethod
+    async def invalidate(cls, delay: float = 0):
+        # call it after commit, so no request caches data older than that
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            await Cache.client().incr(cls.generation_key())
+        except redis.RedisError as e:
+            logger.warning(f"Response cache was not invalidated: {e}")
+
+        if not delay and settings.SQLALCHEMY_DATABASE_URI_READONLY:
+            # reads from lagging replica could be cached in the meantime
+            task = asyncio.create_task(cls.invalidate(delay=settings.DB_READONLY_LAG))
+            cls.tasks.add(task)
+            task.add_done_callback(cls.tasks.discard)
+
+    @classmethod
+    def cacheable(cls, request: Request) -> bool:
+        return (
+            settings.RESPONSE_CACHE_ENABLED
+            and request.method == "GET"
+            and any(x.match(request.url.path) for x in cls.PATHS)
+            and all(
+                request.query_params[x].lower() in cls.FALSE
+                for x in cls.PARAMS_SKIP
+                if x in request.query_params
+            )
+        )
+
+    @classmethod
+    async def key(cls, request: Request) -> str:
+        generation = await Cache.get(cls.generation_key(), default=0)
+        query = urlencode(sorted(request.query_params.multi_items()))
+        output_format = "compact" if JsonResponse.is_compact(request) else "pretty"
+        digest = hashlib.blake2b(
+            f"{request.url.path}?{query}".encode(),
+            digest_size=16,
+        ).hexdigest()
+
+        return Cache.key("responses", generation, output_format, digest)
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+    @staticmethod
+    def pack(status_code: int, headers: list, body: bytes) -> bytes:
+        meta = {"status_code": status_code, "headers": headers}
+        return json.dumps(meta).encode() + b"\n" + body
+
+    @staticmethod
+    def unpack(entry: bytes) -> tuple[int, list, bytes]:
+        meta, body = entry.split(b"\n", 1)
+        meta = json.loads(meta)
+
+        return meta["status_code"], meta["headers"], body
+
+    @classmethod
+    def respond(cls, request: Request, entry: bytes) -> Response:
+        status_code, headers, body = cls.unpack(entry)
+        if status_code != 200:
+            response = Response(content=body, status_code=status_code)
+            for name, value in headers:
+                response.headers.append(name, value)
+            return response
+        etag = cls.etag(body)
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if_none_match = [x.strip() for x in if_none_match.split(",")]
+        if etag in if_none_match or "*" in if_none_match:
+            headers = [(k, v) for k, v in headers if k in ("vary", "cache-control")]
+            return Response(
+                status_code=304,
+                headers={**dict(headers), "etag": etag},
+            )
+
+        response = Response(content=body, status_code=status_code)
+        for name, value in headers:
+            response.headers.append(name, value)
+        response.headers["etag"] = etag
+
+        return response
+
+    @classmethod
+    async def compute(cls, request: Request, call_next) -> tuple[bytes, bool]:
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        headers = [
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in response.headers.raw
+            if name.decode("latin-1") not in cls.HEADERS_SKIP
+        ]
+        entry = cls.pack(response.status_code, headers, body)
+
+        # errors are not cached, but still returned
+        return entry, response.status_code == 200
+
+    @classmethod
+    async def middleware(cls, request: Request, call_next):
+        if not cls.cacheable(request):
+            return await call_next(request)
+
+        try:
+            key = await cls.key(request)
+            entry = await Cache.get(key, codec=BytesCodec)
+        except redis.RedisError as e:
+            # cache is optional, requests are served without it
+            logger.warning(f"Response cache is not available: {e}")
+            return await call_next(request)
+        if entry is not None:
+            return cls.respond(request, entry)
+
+        if key in cls.inflight:
+            entry = await asyncio.shield(cls.inflight[key])
+            if entry is not None:
+                return cls.respond(request, entry)
+            # leader failed, computing it separately
+            return await call_next(request)
+
+        future = asyncio.get_running_loop().create_future()
+        cls.inflight[key] = future
+        try:
+            entry, cacheable = await cls.compute(request, call_next)
+            if cacheable:
+                try:
+                    await Cache.set(
+                        key,
+                        entry,
+                        ttl=settings.RESPONSE_CACHE_TTL,
+                        codec=BytesCodec,
+                    )
+                except redis.RedisError as e:
+                    logger.warning(f"Response was not cached: {e}")
+                future.set_result(entry)
+            else:
+                future.set_result(None)
+        except BaseException:
+            if not future.done():
+                future.set_result(None)
+            raise
+        finally:
+            cls.inflight.pop(key, None)
+
+        return cls.respond(request, entry)
@@ -0,0 +1,129 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+
+
+# time is split into slots of SLOT_MINUTES, feeds are moved to slots with
+# less than SLOT_BUDGET feeds due, so parser load stays flat
+class Slots:
+    # _delayed is naive, slots are counted the same way in Python and SQL
+    EPOCH = datetime(1970, 1, 1)
+    # first key of advisory locks of slots, second one is slot number
+    LOCK_NAMESPACE = 5107
+
+    @staticmethod
+    def seconds() -> int:
+        return settings.SLOT_MINUTES * 60
+
+    @classmethod
+    def slot(cls, moment: datetime) -> int:
+        return int((moment - cls.EPOCH).total_seconds() // cls.seconds())
+
+    @classmethod
+    def start(cls, slot: int) -> datetime:
+        return cls.EPOCH + timedelta(seconds=slot * cls.seconds())
+
+    @classmethod
+    async def load(
+        cls,
+        start: datetime,
+        end: datetime,
+        session: AsyncSession,
+        exclude: int = None,
+    ) -> dict[int, int]:
+        # circular import: Feed model uses Slots
+        from models.model_feeds import Feed
+
+        slot = func.floor(func.extract("epoch", Feed._delayed) / cls.seconds())
+        query = select(slot, func.count())
+        query = query.where(
+            Feed.is_active(),
+            Feed._delayed >= start,
+            Feed._delayed < end,
+        )
+        if exclude is not None:
+            # feed being scheduled is not in its current slot anymore
+            query = query.where(Feed._id != exclude)
+        query = query.group_by(slot)
+
+        return {int(x): count for x, count in await session.execute(query)}
+
+    @classmethod
+    async def lock(cls, slot: int, session: AsyncSession) -> bool:
+        # held until transaction ends, so slot is counted again only
+        # after feeds allocated into it by other transactions are committed
+        query = select(func.pg_try_advisory_xact_lock(cls.LOCK_NAMESPACE, slot))
+        return await session.scalar(query)
+
+    @classmethod
+    async def allocate(
+        cls,
+        target: datetime,
+        earliest: datetime,
+        latest: datetime,
+        session: AsyncSession,
+        feed_id: int = None,
+    ) -> datetime:
+        # slot closest to target that still has capacity,
+        # least loaded one when all of them are full
+        earliest = max(earliest, target - timedelta(minutes=settings.SLOT_MAX_SHIFT))
+        latest = min(latest, target + timedelta(minutes=settings.SLOT_MAX_SHIFT))
+        first, last = cls.slot(earliest), cls.slot(latest)
+        wanted = min(max(cls.slot(target), first), last)
+
+        load = await cls.load(cls.start(first), cls.start(last + 1), session, feed_id)
+        slots = sorted(range(first, last + 1), key=lambda x: abs(x - wanted))
+        chosen = None
+        for x in slots:
+            if load.get(x, 0) >= settings.SLOT_BUDGET:
+                continue
+            # slot being filled by another transaction is skipped, like
+            # SKIP LOCKED; counted again under lock, as load could be stale
+            if not await cls.lock(x, session):
+                continue
+            count = await cls.load(cls.start(x), cls.start(x + 1), session, feed_id)
+            if count.get(x, 0) < settings.SLOT_BUDGET:
+                chosen = x
+                break
+        if chosen is None:
+            chosen = min(slots, key=lambda x: load.get(x, 0))
+        if chosen == wanted:
+            return target
+
+        moment = cls.start(chosen) + timedelta(seconds=random.uniform(0, cls.seconds()))
+
+        return min(max(moment, earliest), latest)
+
+    @classmethod
+    async def histogram(cls, hours: int, session: AsyncSession) -> dict:
+        # circular import: Feed model uses Slots
+        from models.model_feeds import Feed
+
+        first = cls.slot(datetime.now())
+        last = cls.slot(datetime.now() + timedelta(hours=hours))
+        load = await cls.load(cls.start(first), cls.start(last + 1), session)
+
+        query = select(func.count()).where(
+            Feed.is_active(),
+            Feed._delayed < cls.start(first),
+        )
+        slots = [
+            {
+                "start": cls.start(x).isoformat(),
+                "feeds": load.get(x, 0),
+            }
+            for x in range(first, last + 1)
+        ]
+
+        return {
+            "slot_minutes": settings.SLOT_MINUTES,
+            "budget": settings.SLOT_BUDGET,
+            "overdue": await session.scalar(query),
+            "peak": max(x["feeds"] for x in slots),
+            "over_budget": sum(x["feeds"] > settings.SLOT_BUDGET for x in slots),
+            "slots": slots,
+        }
@@ -1,27 +1,64 @@
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
+from uuid import uuid4
 
 from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
 
 from config.settings import settings
+from services.service_query_stats import QueryStats
 
 
-class SQLAlchemy:
-    # Create engine and sessionmaker ONCE
-    engine = create_async_engine(
-        settings.SQLALCHEMY_DATABASE_URI,
+def create_engine(uri: str) -> AsyncEngine:
+    connect_args = {
+        "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+    }
+    if settings.DB_PGBOUNCER:
+        connect_args = {
+            "prepared_statement_cache_size": 0,
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+
+    return create_async_engine(
+        uri,
         future=True,
         echo=False,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        connect_args=connect_args,
     )
+
+
+class SQLAlchemy:
+    # Create engine and sessionmaker ONCE
+    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI)
     async_session = async_sessionmaker(
         engine,
         expire_on_commit=False,
         class_=AsyncSession,
     )
+    # same as primary, if there is no replica
+    if settings.SQLALCHEMY_DATABASE_URI_READONLY:
+        engine_readonly = create_engine(settings.SQLALCHEMY_DATABASE_URI_READONLY)
+    else:
+        engine_readonly = engine
+    async_session_readonly = async_sessionmaker(
+        engine_readonly,
+        expire_on_commit=False,
+        class_=AsyncSession,
+    )
+    QueryStats.instrument(engine)
+    if engine_readonly is not engine:
+        QueryStats.instrument(engine_readonly)
 
     @classmethod
     async def get_db_session(cls) -> AsyncGenerator[AsyncSession, None]:
@@ -33,8 +70,65 @@ class SQLAlchemy:
                 await session.rollback()
                 raise
 
+    @classmethod
+    async def get_db_session_readonly(cls) -> AsyncGenerator[AsyncSession, None]:
+        # for GET endpoints only, nothing is committed
+        async with cls.async_session_readonly() as session:
+            yield session
+
+    @classmethod
+    async def dispose(cls):
+        await cls.engine.dispose()
+        if cls.engine_readonly is not cls.engine:
+            await cls.engine_readonly.dispose()
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        engines = {"primary": cls.engine}
+        if cls.engine_readonly is not cls.engine:
+            engines["readonly"] = cls.engine_readonly
+
+        return {
+            name: {
+                "size": engine.pool.size(),
+                "checked_in": engine.pool.checkedin(),
+                "checked_out": engine.pool.checkedout(),
+                "overflow": engine.pool.overflow(),
+            }
+            for name, engine in engines.items()
+        }
+
+    @classmethod
+    @asynccontextmanager
+    async def session_scope(cls) -> AsyncIterator[AsyncSession]:
+        # same as get_db_session, but for code running outside of requests
+        # (scheduled jobs, background tasks)
+        async with cls.async_session() as session:
+            try:
+                yield session
+                await session.commit()
+            except exc.SQLAlchemyError:
+                await session.rollback()
+                raise
+
     async def execute_first(query, session: AsyncSession):
         return (await session.execute(query)).scalars().first()
 
     async def execute_all(query, session: AsyncSession):
         return (await session.execute(query)).scalars().all()
+
+    @classmethod
+    async def stream_all(cls, query, yield_per: int = 1000) -> AsyncIterator:
+        # server-side cursor, rows are fetched in batches of yield_per;
+        # uses its own session, because streamed responses outlive
+        # request dependencies
+        async with cls.async_session() as session:
+            result = await session.stream_scalars(
+                query.execution_options(yield_per=yield_per),
+            )
+            try:
+                async for item in result:
+                    yield item
+            finally:
+                # cursor is released even if iteration stops midway
+                await result.close()
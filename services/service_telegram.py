@@ -1,7 +1,11 @@
+import asyncio
+import time
+
 import telegram
 from telegram.helpers import escape_markdown as em
 
 from config.settings import settings
+from services.service_metrics import Metrics
 
 
 class TelegramService:
@@ -11,22 +15,53 @@ class TelegramService:
         "\n"
         "([OPEN]({href})) - ([EDIT](http://192.168.0.155:30011/feeds/{feed_id}/edit))"
     )
+    # one bot is reused for all messages
+    _bot: telegram.Bot = None
+    # messages are sent one by one, no more often than TELEGRAM_MESSAGE_INTERVAL
+    lock = asyncio.Lock()
+    last_sent = 0.0
 
     @classmethod
-    async def send_message(cls, msg):
-        await telegram.Bot(settings.TELEGRAM_BOTTOKEN).sendMessage(
-            parse_mode=cls.PARSE_MODE,
-            chat_id=settings.TELEGRAM_CHATID,
-            text=msg,
-        )
+    async def bot(cls) -> telegram.Bot:
+        if cls._bot is None:
+            bot = telegram.Bot(settings.TELEGRAM_BOTTOKEN)
+            await bot.initialize()
+            cls._bot = bot
+
+        return cls._bot
 
     @classmethod
-    async def send_feed_updates(cls, feed, updates):
-        if settings.TELEGRAM_BROADCAST is not True:
-            return
+    async def close(cls):
+        if cls._bot is not None:
+            await cls._bot.shutdown()
+            cls._bot = None
+
+    @classmethod
+    async def send_message(cls, msg):
+        bot = await cls.bot()
+
+        async with cls.lock:
+            delay = cls.last_sent + settings.TELEGRAM_MESSAGE_INTERVAL
+            delay -= time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                with Metrics.timer(Metrics.TELEGRAM_DURATION):
+                    await bot.sendMessage(
+                        parse_mode=cls.PARSE_MODE,
+                        chat_id=settings.TELEGRAM_CHATID,
+                        text=msg,
+                    )
+            finally:
+                cls.last_sent = time.monotonic()
+
+    @staticmethod
+    def format_feed_updates(feed, updates) -> list[str]:
         if not updates:
             raise ValueError(f"Bulk cannot be empty {updates=}")
 
+        messages = []
         tags = [f"#{x}" for x in feed.json.get("tags", [])]
         tags = "[" + ", ".join(tags) + "]"
 
@@ -40,16 +75,23 @@ class TelegramService:
             )
             # cutting big messages and avoiding footer being sent alone
             if len(message) > 2000 and each != updates[-1]:
-                await cls.send_message(
-                    message,
-                )
+                messages.append(message)
                 message = ""
 
         message += f"\n([EDIT](http://192.168.0.155:30011/feeds/{feed._id}/edit))"
+        messages.append(message)
 
-        await cls.send_message(
-            message,
-        )
+        return messages
+
+    @classmethod
+    async def send_feed_updates(cls, feed, updates):
+        if settings.TELEGRAM_BROADCAST is not True:
+            return
+
+        for message in cls.format_feed_updates(feed=feed, updates=updates):
+            await cls.send_message(
+                message,
+            )
 
     @classmethod
     async def send_update(cls, update):